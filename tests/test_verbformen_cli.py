@@ -1,9 +1,61 @@
+import http.server
+import io
+import os
+import threading
+import time
+import urllib.parse
+
 import pytest
-from verbformen_cli import __version__
+from rich.console import Console
+from rich.text import Text
+from verbformen_cli import __version__, display
 from verbformen_cli.clients import VerbformenClient
-from verbformen_cli.downloaders import CachedDownloader, Downloader
-from verbformen_cli.models import Level, Noun, Verb, Adjective, NotFound
-from verbformen_cli.parsers import VerbformenParser
+from verbformen_cli.display import LAYOUTS
+from verbformen_cli.cache_backends import (
+    FilesystemCacheBackend,
+    CacheBackendError,
+    HttpCacheBackend,
+    SqliteCacheBackend,
+    TieredCacheBackend,
+    serve_cache,
+)
+from verbformen_cli.downloaders import (
+    AbstractDownloader,
+    CachedDownloader,
+    CircuitBreakerDownloader,
+    CircuitOpenError,
+    content_hash,
+    Downloader,
+    DownloaderError,
+    Priority,
+    ScheduledDownloader,
+    create_search_url,
+    download_priority,
+)
+from verbformen_cli.export import export_cache
+from verbformen_cli.fragments import (
+    FRAGMENT_FORMAT_VERSION,
+    extract_fragment,
+    fragment_version,
+)
+from verbformen_cli.metrics import MetricsRegistry, metrics
+from verbformen_cli.models import (
+    Level,
+    Noun,
+    Verb,
+    Adjective,
+    NotFound,
+    PartOfSpeech,
+)
+from verbformen_cli.normalize import cache_key, normalize_term
+from verbformen_cli.parsers import ParseError, VerbformenParser
+from verbformen_cli.prefetch import (
+    Prefetcher,
+    RelatedPagePrefetcher,
+    read_word_list,
+)
+from verbformen_cli.results import CachingParser
+from verbformen_cli.routing import PartOfSpeechRouter
 from verbformen_cli.settings import settings
 
 
@@ -124,7 +176,6 @@ def test_nouns(
     level,
     first_definition,
 ):
-
     result = download(search)
     assert isinstance(result, Noun)
     assert result.search == search
@@ -374,3 +425,854 @@ def download(word):
     client = VerbformenClient(downloader=downloader, parser=VerbformenParser())
     result = client.search(word)
     return result
+
+
+NOUN_DESCRIPTION = (
+    "The declension of the noun Hund (dog) is in singular genitive Hund(e)s and in"
+    " the plural nominative Hunde. The noun Hund is declined with the declension"
+    ' endings es/e. The voice of Hund is maskuline and the article "der". Here you'
+    " can not only inflect Hund but also all German nouns. The noun is part of the"
+    " thesaurus of Zertifikat Deutsch respectivly Level A1."
+)
+
+VERB_DESCRIPTION = (
+    "The conjugation of the verb holen (get) is regular. Basic forms are holt, holte"
+    " and hat geholt. The auxiliary verb of holen is haben. The flection is in Active"
+    " and the use as Main. For a better understanding, countless examples of the"
+    " verb holen are available. For practicing and consolidating, there are also"
+    " free worksheets for holen. You can not just holen conjugate, but all German"
+    " verbs. The verb is part of the thesaurus of Zertifikat Deutsch respectivly"
+    " Level A1."
+)
+
+
+def page(meta, search, description="", definitions="", tables=None, links=""):
+    """minimal verbformen-like page with the regions the parser reads"""
+    body = "".join(
+        f"<h2>{title}</h2><table>"
+        + "".join(f"<tr><td>{key}</td><td>{value}</td></tr>" for key, value in rows)
+        + "</table>"
+        for title, rows in (tables or {}).items()
+    )
+    english = f'<p><img alt="English"/> {definitions}</p>' if definitions else ""
+    return (
+        f'<html><head><meta name="description" content="{meta}"/></head><body>'
+        f"<nav>navigation</nav><script>var ads = 1;</script>"
+        f'<input type="search" value="{search}"/>'
+        f'<div class="rAbschnitt">{english}{links}</div>'
+        f"<section><p>{description}</p></section>{body}"
+        f"<footer>footer</footer></body></html>"
+    )
+
+
+def noun_page(links=""):
+    cases = [("Nominative", "der Hund"), ("Accusative", "den Hund")]
+    cases += [("Dative", "dem Hund"), ("Genitive", "des Hundes")]
+    return page(
+        "Declension of noun Hund",
+        "Hund",
+        NOUN_DESCRIPTION,
+        "dog, hound",
+        {"Singular": cases, "Plural": cases},
+        links,
+    )
+
+
+def verb_page(links=""):
+    persons = [(p, "hole") for p in ["ich", "du", "er", "wir", "ihr", "sie"]]
+    titles = ["Present", "Imperfect", "Present Subj.", "Imperf. Subj."]
+    return page(
+        "Conjugation German verb holen",
+        "holen",
+        VERB_DESCRIPTION,
+        "get, fetch",
+        {title: persons for title in titles},
+        links,
+    )
+
+
+def not_found_page(search):
+    return page("German words with ...", search)
+
+
+class FakeDownloader(AbstractDownloader):
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def download(self, url: str) -> str:
+        self.requests.append(url)
+        if url not in self.pages:
+            raise DownloaderError()
+        return self.pages[url]
+
+
+def test_parse_offline_pages():
+    parser = VerbformenParser()
+    noun = parser.parse_page(noun_page())
+    assert isinstance(noun, Noun)
+    assert (noun.article, noun.plural, noun.level) == ("der", "Hunde", Level.A1)
+    assert noun.declensions[0].Dative == "dem Hund"
+    verb = parser.parse_page(verb_page())
+    assert isinstance(verb, Verb)
+    assert verb.definitions == ["get", "fetch"]
+    assert isinstance(parser.parse_page(not_found_page("zzz")), NotFound)
+
+
+def test_metrics_disabled_records_nothing():
+    registry = MetricsRegistry()
+    with registry.timer("stage"):
+        registry.increment("calls")
+    assert registry.to_dict() == {"counters": [], "histograms": []}
+
+
+def test_metrics_export(tmp_path):
+    url = "https://www.verbformen.com/?w=Hund"
+    downloader = CachedDownloader(tmp_path, FakeDownloader({url: noun_page()}))
+    client = VerbformenClient(downloader, VerbformenParser())
+    metrics.reset()
+    metrics.enabled = True
+    try:
+        client.search("Hund")
+        client.search("Hund")
+    finally:
+        metrics.enabled = False
+    assert metrics.counter_value("verbformen_cache_requests_total", result="hit") == 1
+    assert metrics.counter_value("verbformen_cache_requests_total", result="miss") == 1
+    assert metrics.histogram("verbformen_parse_seconds", stage="total").count == 2
+    text = metrics.to_prometheus()
+    assert "# TYPE verbformen_parse_seconds histogram" in text
+    assert 'verbformen_parse_seconds_count{stage="soup"} 2' in text
+    assert '"verbformen_cache_requests_total"' in metrics.to_json()
+
+
+def test_read_word_list(tmp_path):
+    path = tmp_path / "words.txt"
+    path.write_text("# rank word count\n1 der 5000\n2\tHund\t10\n\nholen,3\nder\n")
+    assert read_word_list(path) == ["der", "Hund", "holen"]
+
+
+def test_prefetch_skips_fresh_and_resumes(tmp_path):
+    hund, holen, zzz = [create_search_url(w) for w in ["Hund", "holen", "zzz"]]
+    fake = FakeDownloader({hund: noun_page(), holen: verb_page()})
+    downloader = CachedDownloader(tmp_path / "cache", fake)
+    downloader.download(hund)
+    checkpoint = tmp_path / "words.checkpoint"
+
+    prefetcher = Prefetcher(downloader, rate=None, checkpoint=checkpoint)
+    stats = prefetcher.run([hund, holen, zzz])
+    assert (stats.fetched, stats.skipped, stats.failed) == (1, 1, 1)
+    assert sorted(fake.requests) == sorted([hund, holen, zzz])
+    # failures are retried by the next run instead of keeping the checkpoint
+    assert not checkpoint.exists()
+
+    # an interrupted run resumes from its checkpoint
+    fake.pages[zzz] = not_found_page("zzz")
+    fake.requests.clear()
+    checkpoint.write_text(f"# started {time.time()}\n{zzz}\n")
+    stats = Prefetcher(downloader, rate=None, checkpoint=checkpoint).run(
+        [hund, holen, zzz]
+    )
+    assert (stats.fetched, stats.skipped, stats.failed) == (0, 3, 0)
+    assert not fake.requests and not checkpoint.exists()
+
+    # unless the checkpoint is older than the cache max age
+    downloader.max_age = 60
+    checkpoint.write_text(f"# started {time.time() - 120}\n{zzz}\n")
+    stats = Prefetcher(downloader, rate=None, checkpoint=checkpoint).run([zzz])
+    assert stats.fetched == 1 and fake.requests == [zzz]
+
+
+def test_related_pages_are_prefetched(tmp_path):
+    links = (
+        '<a href="/declension/nouns/Hund.htm">Hund</a>'
+        '<a href="https://www.verbformen.com/conjugation/?w=holen">holen</a>'
+        '<a href="/conjugation/?w=holen">holen</a><a href="/impressum.htm">x</a>'
+    )
+    noun_url = create_search_url("Hund", PartOfSpeech.NOUN)
+    verb_url = create_search_url("holen", PartOfSpeech.VERB)
+    fake = FakeDownloader({noun_url: noun_page(links), verb_url: verb_page(links)})
+    downloader = CachedDownloader(tmp_path, fake)
+    related = RelatedPagePrefetcher(downloader, max_depth=2, rate=None)
+    parser = VerbformenParser(on_related=related.submit)
+
+    parser.parse_page(verb_page(links))
+    related.join()
+    assert sorted(fake.requests) == sorted([noun_url, verb_url])
+    assert downloader.is_fresh(noun_url) and downloader.is_fresh(verb_url)
+
+
+def test_related_pages_are_parsed_once(tmp_path):
+    class CountingParser(VerbformenParser):
+        def parse_page(self, html):
+            parsed.append(html)
+            return super().parse_page(html)
+
+    links = '<a href="/declension/nouns/Hund.htm">Hund</a>'
+    noun_url = create_search_url("Hund", PartOfSpeech.NOUN)
+    fake = FakeDownloader({noun_url: noun_page(links)})
+    downloader = CachedDownloader(tmp_path, fake)
+    related = RelatedPagePrefetcher(downloader, max_depth=2, rate=None)
+    parser = CachingParser(
+        CountingParser(on_related=related.submit),
+        FilesystemCacheBackend(tmp_path / "results"),
+    )
+    related.parser = parser
+    parsed = []
+
+    parser.parse_page(verb_page(links))
+    related.join()
+    assert fake.requests == [noun_url]
+    assert parsed == [verb_page(links), noun_page(links)]
+
+    # the prefetched result is served from the result cache
+    assert isinstance(parser.parse_page(noun_page(links)), Noun)
+    assert len(parsed) == 2
+
+
+def test_router_reuses_resolved_page(tmp_path):
+    generic = create_search_url("holen")
+    fake = FakeDownloader({generic: verb_page()})
+    client = VerbformenClient(
+        CachedDownloader(tmp_path, fake),
+        VerbformenParser(),
+        PartOfSpeechRouter(FilesystemCacheBackend(tmp_path)),
+    )
+    assert isinstance(client.search("holen"), Verb)
+    router = PartOfSpeechRouter(FilesystemCacheBackend(tmp_path))
+    assert router.resolve("holen", PartOfSpeech.VERB) == generic
+    assert router.resolve("holen", PartOfSpeech.NOUN) is None
+
+    client.router = router
+    assert isinstance(client.search("holen", PartOfSpeech.VERB), Verb)
+    assert fake.requests == [generic]
+
+
+def test_search_all_pos(tmp_path):
+    fake = FakeDownloader(
+        {
+            create_search_url("Hund"): noun_page(),
+            create_search_url("Hund", PartOfSpeech.NOUN): noun_page(),
+            create_search_url("Hund", PartOfSpeech.VERB): verb_page(),
+        }
+    )
+    client = VerbformenClient(
+        CachedDownloader(tmp_path, fake), VerbformenParser(), PartOfSpeechRouter()
+    )
+    results = client.search_all_pos("Hund")
+    assert sorted(type(r).__name__ for r in results) == ["Noun", "Verb"]
+    assert len(fake.requests) == 3
+
+    fake.requests.clear()
+    client.search_all_pos("Hund")
+    assert fake.requests == []
+
+
+def test_normalize_term():
+    nfd = "Ma\u0308dchen"
+    assert normalize_term(nfd) == "Mädchen"
+    assert normalize_term(" essen ") == "essen"
+    assert normalize_term("Essen") == "Essen"
+    assert normalize_term("essen", PartOfSpeech.NOUN) == "Essen"
+    assert normalize_term("Holen", PartOfSpeech.VERB) == "holen"
+    assert normalize_term("Maße") == "Maße"
+    assert normalize_term("Maße", fold_sharp_s=True) == "Masse"
+    assert create_search_url(nfd) == create_search_url("Mädchen")
+    assert create_search_url("Mädchen") == "https://www.verbformen.com/?w=M%C3%A4dchen"
+
+
+def test_deduplicate_cache(tmp_path):
+    url = create_search_url("Mädchen")
+    for raw in ["https://www.verbformen.com/?w=Mädchen", url.replace("C3%A4", "c3%a4")]:
+        (tmp_path / urllib.parse.quote(raw, safe="")).write_text("legacy")
+    downloader = CachedDownloader(tmp_path, FakeDownloader({}))
+    assert downloader.deduplicate() == (1, 1)
+    assert list(downloader.cache.keys()) == [cache_key(url)]
+    assert list(downloader.content_hashes()) == [content_hash("legacy")]
+    assert (
+        downloader.download("https://www.verbformen.com/?w=Ma\u0308dchen") == "legacy"
+    )
+
+
+def test_fragment_cache(tmp_path):
+    url = create_search_url("holen")
+    full = verb_page('<a href="/declension/nouns/Holen.htm">Holen</a>')
+    fragment = extract_fragment(full)
+    assert fragment_version(full) is None
+    assert fragment_version(fragment) == FRAGMENT_FORMAT_VERSION
+    assert "footer" not in fragment and "ads" not in fragment
+    parser = VerbformenParser()
+    assert parser.parse_page(fragment) == parser.parse_page(full)
+    assert parser.extract_related_links(fragment) == parser.extract_related_links(full)
+
+    fake = FakeDownloader({url: full})
+    downloader = CachedDownloader(tmp_path, fake, fragments=True)
+    assert downloader.download(url) == fragment
+    assert list(downloader.cached_pages()) == [(content_hash(fragment), fragment)]
+
+    # full pages from a plain cache are converted on read, without downloading
+    (tmp_path / cache_key(url)).write_text(full)
+    assert downloader.download(url) == fragment
+    assert fake.requests == [url]
+
+    # fragments of another format version are downloaded again
+    (tmp_path / cache_key(url)).write_text(
+        fragment.replace('content="1"', 'content="0"')
+    )
+    assert downloader.download(url) == fragment
+    assert fake.requests == [url, url]
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet", "arrow"])
+def test_export_cache(tmp_path, file_format):
+    if file_format != "csv":
+        pytest.importorskip("pyarrow")
+    pages = {
+        create_search_url("Hund"): noun_page(),
+        create_search_url("holen"): verb_page(),
+        create_search_url("zzz"): not_found_page("zzz"),
+    }
+    downloader = CachedDownloader(tmp_path / "cache", FakeDownloader(pages))
+    for url in pages:
+        downloader.download(url)
+
+    out = tmp_path / "out"
+    stats = export_cache(downloader, VerbformenParser(), out, file_format, 3)
+    assert (stats.exported, stats.skipped) == (2, 1)
+    assert sorted(p.name for p in out.iterdir()) == sorted(
+        f"{t}.{file_format}"
+        for t in ["nouns", "verbs", "adjectives", "declensions", "conjugations"]
+    )
+    if file_format == "csv":
+        nouns = (out / "nouns.csv").read_text().splitlines()
+        assert nouns[0].startswith("search,text,level,definitions,genitive")
+        assert nouns[1].startswith("Hund,Hund,A1,dog; hound,Hund(e)s,Hunde")
+        assert len((out / "conjugations.csv").read_text().splitlines()) == 5
+    else:
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        def read(name):
+            path = str(out / f"{name}.{file_format}")
+            if file_format == "parquet":
+                return pyarrow.parquet.read_table(path)
+            return pyarrow.ipc.open_file(path).read_all()
+
+        assert read("nouns").column("definitions").to_pylist() == [["dog", "hound"]]
+        assert read("declensions").num_rows == 2
+        assert read("adjectives").num_rows == 0
+
+
+def test_negative_cache(tmp_path):
+    url = create_search_url("zzz")
+    fake = FakeDownloader({})
+    downloader = CachedDownloader(tmp_path, fake, negative_ttl=60)
+    for _ in range(3):
+        with pytest.raises(DownloaderError):
+            downloader.download(url)
+    assert fake.requests == [url]
+
+    error_key = f"errors/{cache_key(url)}"
+    downloader.cache.set(error_key, "", stored_at=time.time() - 120)
+    fake.pages[url] = not_found_page("zzz")
+    assert downloader.download(url) == fake.pages[url]
+    assert downloader.cache.get(error_key) is None
+
+
+def test_circuit_breaker():
+    fake = FakeDownloader({"ok": "page"})
+    breaker = CircuitBreakerDownloader(fake, failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(DownloaderError):
+            breaker.download("down")
+    with pytest.raises(CircuitOpenError):
+        breaker.download("ok")
+    assert fake.requests == ["down", "down"]
+
+    breaker.opened_at -= 60
+    assert breaker.download("ok") == "page"
+    assert breaker.opened_at is None and breaker.failures == 0
+
+
+def test_circuit_breaker_ignores_client_errors():
+    class StatusDownloader(AbstractDownloader):
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+        def download(self, url: str) -> str:
+            raise DownloaderError(url, self.status_code)
+
+    for status_code in [404, 410]:
+        breaker = CircuitBreakerDownloader(StatusDownloader(status_code), 2, 60)
+        for _ in range(3):
+            with pytest.raises(DownloaderError) as info:
+                breaker.download("missing")
+            assert not isinstance(info.value, CircuitOpenError)
+        assert breaker.opened_at is None and breaker.failures == 0
+
+    for status_code in [429, 503]:
+        breaker = CircuitBreakerDownloader(StatusDownloader(status_code), 2, 60)
+        for _ in range(2):
+            with pytest.raises(DownloaderError):
+                breaker.download("busy")
+        with pytest.raises(CircuitOpenError):
+            breaker.download("busy")
+
+
+def test_circuit_breaker_trial_ends_on_interrupt():
+    class InterruptedDownloader(AbstractDownloader):
+        def download(self, url: str) -> str:
+            raise KeyboardInterrupt
+
+    fake = FakeDownloader({"ok": "page"})
+    breaker = CircuitBreakerDownloader(fake, failure_threshold=1, reset_timeout=60)
+    with pytest.raises(DownloaderError):
+        breaker.download("down")
+    breaker.opened_at -= 60
+    breaker.delegate = InterruptedDownloader()
+    with pytest.raises(KeyboardInterrupt):
+        breaker.download("ok")
+    assert not breaker._trial
+
+    breaker.delegate = fake
+    assert breaker.download("ok") == "page"
+    assert breaker.opened_at is None
+
+
+def test_circuit_breaker_trips_on_timeouts():
+    class SlowHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(1)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    breaker = CircuitBreakerDownloader(
+        Downloader(timeout=0.05), failure_threshold=2, reset_timeout=60
+    )
+    try:
+        for _ in range(2):
+            with pytest.raises(DownloaderError, match="timed out"):
+                breaker.download(url)
+        with pytest.raises(CircuitOpenError):
+            breaker.download(url)
+    finally:
+        server.shutdown()
+
+
+def test_stale_pages(tmp_path):
+    url = create_search_url("Hund")
+    fake = FakeDownloader({url: "old"})
+    downloader = CachedDownloader(tmp_path, fake, max_age=10, stale_while_revalidate=60)
+    downloader.download(url)
+    path = tmp_path / cache_key(url)
+
+    # within the revalidation window the stale page is served and refreshed
+    os.utime(path, (time.time() - 30, time.time() - 30))
+    fake.pages[url] = "new"
+    assert downloader.download(url) == "old"
+    for _ in range(100):
+        if downloader.is_fresh(url):
+            break
+        time.sleep(0.01)
+    assert downloader.download(url) == "new"
+
+    # past the window the page is downloaded again, but served if that fails
+    os.utime(path, (time.time() - 300, time.time() - 300))
+    del fake.pages[url]
+    assert downloader.download(url) == "new"
+    downloader.stale_if_error = False
+    with pytest.raises(DownloaderError):
+        downloader.download(url)
+
+
+@pytest.fixture
+def http_cache(tmp_path):
+    """stand-in for the shared key-value store, backed by sqlite"""
+    server = serve_cache(SqliteCacheBackend(tmp_path / "shared.db"), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield HttpCacheBackend(f"http://127.0.0.1:{server.server_address[1]}")
+    server.shutdown()
+
+
+@pytest.mark.parametrize("kind", ["filesystem", "sqlite", "http"])
+def test_cache_backends(tmp_path, http_cache, kind):
+    backend = {
+        "filesystem": lambda: FilesystemCacheBackend(tmp_path / "fs"),
+        "sqlite": lambda: SqliteCacheBackend(tmp_path / "cache.db"),
+        "http": lambda: http_cache,
+    }[kind]()
+    assert backend.get("missing") is None
+    backend.set("page%3Fw%3DM%C3%A4dchen", "Mädchen", stored_at=1000.0)
+    backend.set("errors/page", "503")
+    assert backend.get("page%3Fw%3DM%C3%A4dchen") == ("Mädchen", 1000.0)
+    assert list(backend.keys()) == ["page%3Fw%3DM%C3%A4dchen"]
+    assert list(backend.keys("errors")) == ["page"]
+    backend.delete("errors/page")
+    assert backend.get("errors/page") is None
+
+
+def test_shared_cache_serves_all_nodes(tmp_path, http_cache):
+    url = create_search_url("Hund")
+    fake = FakeDownloader({url: noun_page()})
+    nodes = [
+        VerbformenClient(
+            CachedDownloader(
+                TieredCacheBackend(FilesystemCacheBackend(tmp_path / node), http_cache),
+                fake,
+            ),
+            VerbformenParser(),
+            PartOfSpeechRouter(http_cache),
+        )
+        for node in ["a", "b"]
+    ]
+    assert nodes[0].search("Hund") == nodes[1].search("Hund")
+    assert fake.requests == [url]
+    assert (tmp_path / "b" / cache_key(url)).is_file()
+
+
+def test_shared_cache_outage_falls_back_to_local(tmp_path):
+    server = serve_cache(SqliteCacheBackend(tmp_path / "shared.db"), port=0)
+    server.server_close()
+    remote = HttpCacheBackend(f"http://127.0.0.1:{server.server_address[1]}")
+    cache = TieredCacheBackend(FilesystemCacheBackend(tmp_path / "local"), remote)
+    url = create_search_url("Hund")
+    fake = FakeDownloader({url: noun_page()})
+    downloader = CachedDownloader(cache, fake)
+    assert downloader.download(url) == noun_page()
+    assert downloader.download(url) == noun_page()
+    assert fake.requests == [url]
+    assert list(cache.keys()) == [cache_key(url)]
+
+
+def test_expired_local_pages_are_refreshed_from_shared_cache(tmp_path, http_cache):
+    url = create_search_url("Hund")
+    fake = FakeDownloader({url: "old"})
+    a, b = [
+        CachedDownloader(
+            TieredCacheBackend(
+                FilesystemCacheBackend(tmp_path / node), http_cache, max_age=60
+            ),
+            fake,
+            max_age=60,
+            stale_if_error=False,
+        )
+        for node in ["a", "b"]
+    ]
+    a.download(url)
+    assert b.download(url) == "old"
+    # every copy expires, then a refreshes the page
+    pointer = http_cache.get(cache_key(url)).value
+    for backend in [a.cache.local, b.cache.local, http_cache]:
+        backend.set(cache_key(url), pointer, stored_at=0)
+    fake.pages[url] = "new"
+    assert a.download(url) == "new"
+    assert b.download(url) == "new"
+    assert fake.requests == [url, url]
+
+
+def test_cache_server_token(tmp_path):
+    server = serve_cache(SqliteCacheBackend(tmp_path / "shared.db"), port=0, token="s")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with pytest.raises(CacheBackendError, match="token"):
+            HttpCacheBackend(url).set("page", "poisoned")
+        with pytest.raises(CacheBackendError, match="token"):
+            HttpCacheBackend(url, token="wrong").get("page")
+        HttpCacheBackend(url, token="s").set("page", "page")
+        assert HttpCacheBackend(url, token="s").get("page").value == "page"
+    finally:
+        server.shutdown()
+
+
+def test_pages_are_stored_once_per_content(tmp_path):
+    generic, noun = create_search_url("Hund"), create_search_url(
+        "Hund", PartOfSpeech.NOUN
+    )
+    fake = FakeDownloader({generic: noun_page(), noun: noun_page()})
+    downloader = CachedDownloader(tmp_path, fake)
+    downloader.download(generic)
+    downloader.download(noun)
+    assert list(downloader.content_hashes()) == [content_hash(noun_page())]
+
+    # when a page changes upstream its old content is dropped once unreferenced
+    changed = noun_page("<a>changed</a>")
+    fake.pages[generic] = fake.pages[noun] = changed
+    downloader._fetch(noun)
+    assert len(list(downloader.content_hashes())) == 2
+    downloader._fetch(generic)
+    assert downloader.deduplicate() == (0, 1)
+    assert list(downloader.content_hashes()) == [content_hash(changed)]
+
+
+def test_refreshed_pages_are_collected(tmp_path):
+    url = create_search_url("Hund")
+    fake = FakeDownloader({url: noun_page()})
+    downloader = CachedDownloader(tmp_path, fake, max_age=60)
+    downloader.download(url)
+    old = content_hash(noun_page())
+    os.utime(tmp_path / cache_key(url), (0, 0))
+    os.utime(tmp_path / "pages" / old, (0, 0))
+
+    fake.pages[url] = noun_page("<a>changed</a>")
+    stats = Prefetcher(downloader, rate=None).run([url])
+    assert (stats.fetched, stats.removed) == (1, 1)
+    assert list(downloader.content_hashes()) == [content_hash(fake.pages[url])]
+
+
+def test_cached_pages_skip_unrelated_files(tmp_path):
+    urls = [create_search_url("Hund"), create_search_url("Hund", PartOfSpeech.NOUN)]
+    downloader = CachedDownloader(tmp_path, FakeDownloader({}))
+    for url in urls:
+        # inline pages written before content hashing
+        downloader.cache.set(cache_key(url), noun_page())
+    (tmp_path / "cache.db").write_bytes(b"SQLite format 3\x00\xff\xfe")
+    assert list(downloader.cached_pages()) == [(content_hash(noun_page()), noun_page())]
+    assert sorted(downloader.cached_urls()) == sorted(urls)
+
+
+def test_incremental_reparse(tmp_path):
+    class CountingParser(VerbformenParser):
+        calls = 0
+
+        def parse_page(self, html):
+            CountingParser.calls += 1
+            return super().parse_page(html)
+
+    urls = [create_search_url(w) for w in ["Hund", "holen", "zzz"]]
+    pages = [noun_page(), verb_page(), not_found_page("zzz")]
+    downloader = CachedDownloader(tmp_path, FakeDownloader(dict(zip(urls, pages))))
+    parser = CachingParser(CountingParser(), downloader.cache)
+    client = VerbformenClient(downloader, parser)
+    assert isinstance(client.search("Hund"), Noun)
+    assert client.search("Hund") == VerbformenParser().parse_page(noun_page())
+    assert CountingParser.calls == 1
+
+    downloader.download(urls[1])
+    downloader.download(urls[2])
+    stats = parser.reparse(downloader)
+    assert (stats.parsed, stats.current, stats.failed) == (2, 1, 0)
+    assert parser.reparse(downloader).current == 3
+
+    CountingParser.version = "2"
+    assert parser.reparse(downloader).parsed == 3
+    assert CountingParser.calls == 6
+
+
+def test_annotate(tmp_path):
+    hund, holen, zzz = [create_search_url(w) for w in ["Hund", "holen", "zzz"]]
+    fake = FakeDownloader({hund: noun_page(), holen: verb_page()})
+    downloader = CachedDownloader(tmp_path, fake)
+    downloader.download(hund)
+    fake.requests.clear()
+    client = VerbformenClient(downloader, VerbformenParser(), PartOfSpeechRouter())
+
+    text = "Hund, holen! Hund zzz holen 42 Hund"
+    annotations = list(client.annotate(text))
+    assert [a.token for a in annotations] == [
+        "Hund",
+        "holen",
+        "Hund",
+        "zzz",
+        "holen",
+        "Hund",
+    ]
+    first = annotations[0]
+    assert text[first.start : first.end] == "Hund"
+    assert (first.lemma, first.part_of_speech, first.level) == (
+        "Hund",
+        PartOfSpeech.NOUN,
+        Level.A1,
+    )
+    assert annotations[1].definitions == ["get", "fetch"]
+    assert annotations[3].lemma is None
+    assert sorted(fake.requests) == sorted([holen, zzz])
+
+
+def test_annotate_skips_malformed_pages(tmp_path):
+    hund, kaputt, holen = [create_search_url(w) for w in ["Hund", "kaputt", "holen"]]
+    malformed = "<html><head></head><body>no description</body></html>"
+    fake = FakeDownloader({hund: noun_page(), kaputt: malformed, holen: verb_page()})
+    client = VerbformenClient(
+        CachedDownloader(tmp_path, fake), VerbformenParser(), PartOfSpeechRouter()
+    )
+
+    annotations = list(client.annotate("Hund kaputt holen"))
+    assert [a.lemma for a in annotations] == ["Hund", None, "holen"]
+    assert annotations[1].definitions == []
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_display_summaries_streams(monkeypatch, layout):
+    parser = VerbformenParser()
+    results = [parser.parse_page(noun_page()), parser.parse_page(verb_page())]
+    results.append(parser.parse_page(not_found_page("zzz")))
+    output = io.StringIO()
+    monkeypatch.setattr(display, "console", Console(file=output, width=120))
+    tables = []
+    monkeypatch.setattr(
+        display, "declension_table", lambda d: tables.append(d) or Text("")
+    )
+
+    def stream():
+        for result in results:
+            yield result
+            # cards are written before the next result is produced
+            if layout != "grid":
+                assert result.search in output.getvalue()
+
+    assert display.display_summaries(stream(), layout=layout, grid_columns=1) == 3
+    text = output.getvalue()
+    assert "der Hund" in text and "No results found" in text
+    assert not tables
+
+    # every layout shows the tables of the cards it writes
+    output.seek(0)
+    output.truncate()
+    display.display_summaries(results, include_tables=True, layout=layout)
+    if layout == "plain":
+        assert "Nominative\tder Hund\tder Hund" in output.getvalue()
+        assert "ich\thole" in output.getvalue()
+    else:
+        assert len(tables) == 1
+
+
+def near_miss_descriptions(length):
+    """descriptions that almost match, which backtracking patterns take
+    polynomial time to reject"""
+    verb = "The conjugation of the verb holen (get) is regular. Basic forms are "
+    noun = "The declension of the noun Hund "
+    adjective = "The declension of the adjective gut "
+    comparison = adjective + "(good) uses these forms of the comparison gut,besser,"
+    for prefix, repeated in [
+        (verb, "a, a and a. The stem vowels are o. "),
+        (verb, "a and "),
+        (verb, "a, "),
+        (noun, "(dog) is in singular genitive "),
+        (noun, "((dog) "),
+        (adjective, "(good) "),
+        (comparison, "am, besten. "),
+    ]:
+        yield (prefix + repeated * length)[:length]
+
+
+def test_description_matching_is_bounded():
+    parser = VerbformenParser()
+    extract = [
+        parser._extract_noun_data,
+        parser._extract_verb_data,
+        parser._extract_adjective_data,
+    ]
+    for description in near_miss_descriptions(parser.max_description_length):
+        for method in extract:
+            started = time.perf_counter()
+            with pytest.raises(ParseError):
+                method(description)
+            assert time.perf_counter() - started < 0.05
+
+    # the structured patterns still read ordinary descriptions
+    assert parser._extract_verb_data(VERB_DESCRIPTION)["perfect"] == "hat geholt"
+    assert parser._extract_noun_data(NOUN_DESCRIPTION)["plural_ending"] == "e"
+
+
+def test_parse_budget():
+    with pytest.raises(ParseError, match="time budget"):
+        VerbformenParser(time_budget=0).parse_page(noun_page())
+    with pytest.raises(ParseError, match="longer than"):
+        VerbformenParser(max_description_length=100).parse_page(verb_page())
+    assert VerbformenParser(time_budget=60).parse_page(verb_page()).text == "holen"
+
+
+def test_scheduler_serves_interactive_first():
+    release = threading.Semaphore(0)
+    started = []
+
+    class BlockingDownloader(AbstractDownloader):
+        def download(self, url: str) -> str:
+            started.append(url)
+            release.acquire()
+            return url
+
+    scheduled = ScheduledDownloader(BlockingDownloader(), connections=3)
+
+    def download(url, priority):
+        with download_priority(priority):
+            scheduled.download(url)
+
+    threads = []
+
+    def start(url, priority, queued):
+        thread = threading.Thread(target=download, args=(url, priority))
+        thread.start()
+        threads.append(thread)
+        while sum(scheduled.queued().values()) + len(started) < queued:
+            time.sleep(0.001)
+
+    # prefetching is limited to one connection, background traffic to two
+    start("prefetch 1", Priority.PREFETCH, 1)
+    start("prefetch 2", Priority.PREFETCH, 2)
+    start("batch 1", Priority.BATCH, 3)
+    start("batch 2", Priority.BATCH, 4)
+    assert started == ["prefetch 1", "batch 1"]
+    # the connection left free serves an interactive lookup at once
+    start("interactive 1", Priority.INTERACTIVE, 5)
+    assert started[2] == "interactive 1"
+    start("interactive 2", Priority.INTERACTIVE, 6)
+    assert scheduled.queued()[Priority.INTERACTIVE] == 1
+
+    # the first freed connection goes to the waiting interactive lookup
+    release.release()
+    while len(started) < 4:
+        time.sleep(0.001)
+    assert started[3] == "interactive 2"
+    for _ in range(5):
+        release.release()
+    for thread in threads:
+        thread.join()
+    assert sorted(started[4:]) == ["batch 2", "prefetch 2"]
+    assert scheduled.active == {p: 0 for p in Priority}
+
+
+def test_interrupted_scheduled_download_frees_its_place(monkeypatch):
+    class InterruptedEvent(threading.Event):
+        def wait(self, timeout=None):
+            raise KeyboardInterrupt
+
+    scheduled = ScheduledDownloader(FakeDownloader({"url": "page"}), connections=1)
+    monkeypatch.setattr(threading, "Event", InterruptedEvent)
+    # interrupted after being granted a connection
+    with pytest.raises(KeyboardInterrupt):
+        scheduled.download("url")
+    assert scheduled.active == {p: 0 for p in Priority}
+
+    # interrupted while queued
+    scheduled.active[Priority.INTERACTIVE] = 1
+    with pytest.raises(KeyboardInterrupt):
+        scheduled.download("url")
+    assert scheduled.queued() == {p: 0 for p in Priority}
+
+
+def test_prefetched_pages_are_routed(tmp_path):
+    links = '<a href="/declension/nouns/Hund.htm">Hund</a>'
+    noun_url = create_search_url("Hund", PartOfSpeech.NOUN)
+    fake = FakeDownloader({noun_url: noun_page()})
+    downloader = CachedDownloader(tmp_path, fake)
+    router = PartOfSpeechRouter()
+    related = RelatedPagePrefetcher(downloader, rate=None, router=router, max_seen=1)
+    VerbformenParser(on_related=related.submit).parse_page(verb_page(links))
+    related.join()
+    assert fake.requests == [noun_url]
+
+    # the usual follow-up lookup has no hint and finds the prefetched page
+    client = VerbformenClient(downloader, VerbformenParser(), router)
+    assert client.search("Hund").article == "der"
+    assert fake.requests == [noun_url]
+
+    related.submit([create_search_url("holen"), create_search_url("essen")])
+    related.join()
+    assert list(related._seen) == [create_search_url("essen")]
@@ -0,0 +1,369 @@
+import abc
+import hmac
+import http.server
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import urllib.parse
+from typing import Callable, Iterator, NamedTuple, Optional, TypeVar
+
+import requests
+
+from verbformen_cli.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CacheEntry(NamedTuple):
+    value: str
+    stored_at: float
+
+
+class CacheBackendError(Exception):
+    ...
+
+
+class AbstractCacheBackend(abc.ABC):
+    """
+    Key-value store for cached pages and derived data.
+
+    Keys are strings of the form ``name`` or ``namespace/name``; names never
+    contain a slash. Every entry records when it was stored, which callers use
+    to decide freshness.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, stored_at: Optional[float] = None):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abc.abstractmethod
+    def keys(self, namespace: str = "") -> Iterator[str]:
+        """names of the entries in ``namespace``, without the namespace prefix"""
+        ...
+
+
+class FilesystemCacheBackend(AbstractCacheBackend):
+    """One file per entry; namespaces are subdirectories of ``directory``."""
+
+    def __init__(self, directory: pathlib.Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        path = self._path(key)
+        try:
+            stored_at = path.stat().st_mtime
+            return CacheEntry(path.read_text(encoding="UTF-8"), stored_at)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: str, stored_at: Optional[float] = None):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # write via a temporary file so concurrent readers never see partial pages
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_text(value, encoding="UTF-8")
+        if stored_at is not None:
+            os.utime(tmp, (stored_at, stored_at))
+        os.replace(tmp, path)
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def keys(self, namespace: str = "") -> Iterator[str]:
+        directory = self.directory / namespace
+        if not directory.is_dir():
+            return
+        for path in directory.iterdir():
+            if path.is_file() and not path.name.startswith("."):
+                yield path.name
+
+    def _path(self, key: str) -> pathlib.Path:
+        parts = key.split("/")
+        if len(parts) > 2 or any(p in ("", ".", "..") for p in parts):
+            raise CacheBackendError(f"invalid cache key: {key}")
+        return self.directory.joinpath(*parts)
+
+
+class SqliteCacheBackend(AbstractCacheBackend):
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries"
+                " (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def set(self, key: str, value: str, stored_at: Optional[float] = None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, value, time.time() if stored_at is None else stored_at),
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def keys(self, namespace: str = "") -> Iterator[str]:
+        with self._lock:
+            if namespace:
+                prefix = f"{namespace}/"
+                rows = self._db.execute(
+                    "SELECT substr(key, ?) FROM entries WHERE substr(key, 1, ?) = ?",
+                    (len(prefix) + 1, len(prefix), prefix),
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT key FROM entries WHERE instr(key, '/') = 0"
+                ).fetchall()
+        for (key,) in rows:
+            yield key
+
+
+class HttpCacheBackend(AbstractCacheBackend):
+    """
+    Client for a shared key-value store speaking a minimal HTTP protocol:
+
+    - ``GET /<key>`` returns the value, with the ``X-Stored-At`` header, or 404
+    - ``PUT /<key>`` stores the request body, ``X-Stored-At`` is optional
+    - ``DELETE /<key>`` removes the entry
+    - ``GET /?namespace=<ns>`` lists the names in a namespace, one per line
+
+    ``serve_cache`` exposes any backend this way. With a ``token``, every request
+    carries it as ``Authorization: Bearer <token>``.
+    """
+
+    def __init__(
+        self, base_url: str, timeout: float = 5.0, token: Optional[str] = None
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        response = self._request("GET", self._url(key))
+        if response.status_code == 404:
+            return None
+        return CacheEntry(response.text, float(response.headers["X-Stored-At"]))
+
+    def set(self, key: str, value: str, stored_at: Optional[float] = None):
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        headers["X-Stored-At"] = repr(time.time() if stored_at is None else stored_at)
+        self._request(
+            "PUT", self._url(key), data=value.encode("UTF-8"), headers=headers
+        )
+
+    def delete(self, key: str):
+        self._request("DELETE", self._url(key))
+
+    def keys(self, namespace: str = "") -> Iterator[str]:
+        response = self._request(
+            "GET", f"{self.base_url}/", params={"namespace": namespace}
+        )
+        yield from filter(None, response.text.split("\n"))
+
+    def _url(self, key: str) -> str:
+        return f"{self.base_url}/{urllib.parse.quote(key, safe='')}"
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise CacheBackendError(f"{method} {url}: {e}") from e
+        if response.status_code == 401:
+            raise CacheBackendError(f"{method} {url}: invalid or missing cache token")
+        if response.status_code not in (200, 204, 404):
+            raise CacheBackendError(f"{method} {url} returned {response.status_code}")
+        response.encoding = "UTF-8"
+        return response
+
+
+class TieredCacheBackend(AbstractCacheBackend):
+    """
+    Read-through local tier in front of a shared backend.
+
+    Reads are answered locally when possible and copied from ``remote`` on a
+    local miss, or when the local entry is older than ``max_age`` and another
+    node may have refreshed it. Writes go to both tiers.
+
+    While ``remote`` is unreachable the local tier is used alone, so an outage
+    of the shared store only costs cache hits.
+    """
+
+    def __init__(
+        self,
+        local: AbstractCacheBackend,
+        remote: AbstractCacheBackend,
+        max_age: Optional[float] = None,
+    ):
+        self.local = local
+        self.remote = remote
+        self.max_age = max_age
+        self._remote_down = False
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self.local.get(key)
+        if entry is not None and not self._expired(entry):
+            return entry
+        remote = self._try_remote(lambda: self.remote.get(key), None)
+        if remote is not None and (entry is None or remote.stored_at > entry.stored_at):
+            self.local.set(key, remote.value, remote.stored_at)
+            return remote
+        return entry
+
+    def set(self, key: str, value: str, stored_at: Optional[float] = None):
+        stored_at = time.time() if stored_at is None else stored_at
+        self._try_remote(lambda: self.remote.set(key, value, stored_at), None)
+        self.local.set(key, value, stored_at)
+
+    def delete(self, key: str):
+        self._try_remote(lambda: self.remote.delete(key), None)
+        self.local.delete(key)
+
+    def keys(self, namespace: str = "") -> Iterator[str]:
+        names = self._try_remote(lambda: list(self.remote.keys(namespace)), None)
+        return iter(names) if names is not None else self.local.keys(namespace)
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self.max_age is not None and time.time() - entry.stored_at > self.max_age
+
+    def _try_remote(self, call: Callable[[], T], default: T) -> T:
+        """``call`` on the remote tier, ``default`` if it is unreachable"""
+        try:
+            result = call()
+        except CacheBackendError as e:
+            metrics.increment("verbformen_shared_cache_errors_total")
+            if not self._remote_down:
+                logger.warning("shared cache unavailable, using local cache: %s", e)
+            self._remote_down = True
+            return default
+        if self._remote_down:
+            logger.warning("shared cache available again")
+            self._remote_down = False
+        return result
+
+
+def create_backend(
+    kind: str,
+    url: Optional[str],
+    local_dir: pathlib.Path,
+    max_age: Optional[float] = None,
+    token: Optional[str] = None,
+) -> AbstractCacheBackend:
+    """
+    :param kind: "filesystem", "sqlite" or "http"
+    :param url: sqlite database path or base url of the shared http store
+    :param local_dir: filesystem cache directory, also the local tier of "http"
+    :param max_age: age after which "http" checks the shared store for a newer
+        entry than the local one
+    :param token: shared secret of the "http" store
+    """
+    if kind == "filesystem":
+        return FilesystemCacheBackend(local_dir)
+    if kind == "sqlite":
+        return SqliteCacheBackend(pathlib.Path(url) if url else local_dir / "cache.db")
+    if kind == "http":
+        if not url:
+            raise ValueError("the http cache backend requires a url")
+        return TieredCacheBackend(
+            FilesystemCacheBackend(local_dir),
+            HttpCacheBackend(url, token=token),
+            max_age,
+        )
+    raise ValueError(f"unknown cache backend: {kind}")
+
+
+def serve_cache(
+    backend: AbstractCacheBackend,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    token: Optional[str] = None,
+) -> http.server.ThreadingHTTPServer:
+    """
+    HTTP server sharing ``backend`` with ``HttpCacheBackend`` clients on other
+    nodes. Call ``serve_forever`` on the result, or run it in a thread.
+
+    With a ``token``, requests without the matching bearer token are refused;
+    without one anybody who can reach ``host`` can read and overwrite pages.
+    """
+    expected = f"Bearer {token}" if token else None
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def parse_request(self) -> bool:
+            if not super().parse_request():
+                return False
+            given = self.headers.get("Authorization", "").encode("UTF-8")
+            if expected and not hmac.compare_digest(given, expected.encode("UTF-8")):
+                self._reply(401, "")
+                return False
+            return True
+
+        def do_GET(self):
+            parsed = urllib.parse.urlsplit(self.path)
+            if parsed.path == "/":
+                query = urllib.parse.parse_qs(parsed.query)
+                names = backend.keys(query.get("namespace", [""])[0])
+                self._reply(200, "\n".join(names))
+                return
+            entry = backend.get(self._key())
+            if entry is None:
+                self._reply(404, "")
+            else:
+                self._reply(200, entry.value, {"X-Stored-At": repr(entry.stored_at)})
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            stored_at = self.headers.get("X-Stored-At")
+            backend.set(
+                self._key(),
+                body.decode("UTF-8"),
+                float(stored_at) if stored_at else None,
+            )
+            self._reply(204, "")
+
+        def do_DELETE(self):
+            backend.delete(self._key())
+            self._reply(204, "")
+
+        def _key(self) -> str:
+            return urllib.parse.unquote(urllib.parse.urlsplit(self.path).path[1:])
+
+        def _reply(self, status: int, body: str, headers: Optional[dict] = None):
+            data = body.encode("UTF-8")
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return http.server.ThreadingHTTPServer((host, port), Handler)
@@ -1,11 +1,59 @@
+import ipaddress
+import pathlib
+import socket
+from typing import Optional
+
 import click
 
 from verbformen_cli import clients
-from verbformen_cli.display import display_summary
+from verbformen_cli.cache_backends import SqliteCacheBackend, serve_cache
+from verbformen_cli.display import (
+    console,
+    LAYOUTS,
+    display_profile,
+    display_summaries,
+    display_summary,
+    max_definitions,
+)
+from verbformen_cli.downloaders import (
+    CachedDownloader,
+    DownloaderError,
+    Priority,
+    create_search_url,
+    download_priority,
+)
+from verbformen_cli.export import FORMATS, export_cache
+from verbformen_cli.metrics import metrics
 from verbformen_cli.models import PartOfSpeech
+from verbformen_cli.parsers import PARSE_ERRORS
+from verbformen_cli.prefetch import Prefetcher, read_word_list
+from verbformen_cli.results import CachingParser
+from verbformen_cli.settings import settings
+
+
+class DefaultCommandGroup(click.Group):
+    """Group that runs ``default_command`` when no subcommand is named."""
+
+    def __init__(self, *args, default_command: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] != "--help":
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup, default_command="lookup")
+def main():
+    """
+    Unofficial client for the verbformen.net dictionary.
+
+    `verbformen WORD` is short for `verbformen lookup WORD`.
+    """
 
 
-@click.command()
+@main.command()
 @click.argument("german_word")
 @click.option(
     "--verb", "hint_pos", flag_value=PartOfSpeech.VERB.value, help="hint this is a verb"
@@ -14,14 +62,242 @@ from verbformen_cli.models import PartOfSpeech
     "--noun", "hint_pos", flag_value=PartOfSpeech.NOUN.value, help="hint this is a noun"
 )
 @click.option("--include_tables")
-def lookup(german_word: str, hint_pos: str = None, include_tables: bool = False):
+@click.option("--profile", is_flag=True, help="print a per-stage timing breakdown")
+def lookup(
+    german_word: str,
+    hint_pos: str = None,
+    include_tables: bool = False,
+    profile: bool = False,
+):
     """
     Lookup a word in the verbformen.net dictionary.
 
     If the part of speech is ambiguous, specify it using --noun or --verb
 
     """
+    metrics.enabled = profile
     part_of_speech_hint = PartOfSpeech[hint_pos.upper()] if hint_pos else None
     client = clients.VerbformenClient.default_client()
     result = client.search(german_word, part_of_speech_hint)
     display_summary(result, include_tables)
+    if profile:
+        display_profile()
+
+
+@main.command()
+@click.argument("wordlist", type=click.Path(exists=True, dir_okay=False))
+@click.option("--include-tables", is_flag=True, help="show declensions/conjugations")
+@click.option(
+    "--layout", type=click.Choice(LAYOUTS), default="cards", show_default=True
+)
+@click.option("--columns", type=int, help="cards per row of the grid layout")
+@click.option("--pager", is_flag=True, help="page the output through $PAGER")
+def show(
+    wordlist: str,
+    include_tables: bool,
+    layout: str,
+    columns: Optional[int],
+    pager: bool,
+):
+    """
+    Lookup every word of WORDLIST and print a summary card for each.
+
+    Cards are printed as soon as each word is resolved.
+    """
+    client = clients.VerbformenClient.default_client()
+
+    def results():
+        for word in read_word_list(pathlib.Path(wordlist)):
+            try:
+                with download_priority(Priority.BATCH):
+                    result = client.search(word)
+            except (DownloaderError, *PARSE_ERRORS) as e:
+                click.echo(f"{word}: {e}", err=True)
+                continue
+            yield result
+
+    display_summaries(results(), include_tables, layout, pager, columns)
+
+
+@main.command()
+@click.argument(
+    "wordlist", required=False, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "--from-cache", is_flag=True, help="re-crawl stale pages already in the cache"
+)
+@click.option("--concurrency", default=4, show_default=True, help="parallel downloads")
+@click.option(
+    "--rate", default=2.0, show_default=True, help="maximum downloads per second"
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="resume file, defaults to WORDLIST.checkpoint",
+)
+def prefetch(
+    wordlist: Optional[str],
+    from_cache: bool,
+    concurrency: int,
+    rate: float,
+    checkpoint: Optional[str],
+):
+    """
+    Warm the cache from a frequency-ranked WORDLIST.
+
+    Pages that are still fresh are skipped. An interrupted run resumes from its
+    checkpoint file.
+    """
+    if not wordlist and not from_cache:
+        raise click.UsageError("pass a WORDLIST or --from-cache")
+    downloader = clients.VerbformenClient.default_client().downloader
+    if not isinstance(downloader, CachedDownloader):
+        raise click.ClickException("prefetch requires a cached downloader")
+
+    urls = []
+    if wordlist:
+        urls += [create_search_url(w) for w in read_word_list(pathlib.Path(wordlist))]
+        checkpoint = checkpoint or f"{wordlist}.checkpoint"
+    if from_cache:
+        urls += list(downloader.cached_urls())
+
+    prefetcher = Prefetcher(
+        downloader,
+        concurrency=concurrency,
+        rate=rate,
+        checkpoint=pathlib.Path(checkpoint) if checkpoint else None,
+    )
+    stats = prefetcher.run(dict.fromkeys(urls))
+    console.print(
+        f"fetched {stats.fetched}, skipped {stats.skipped}, failed {stats.failed},"
+        f" removed {stats.removed}"
+    )
+
+
+@main.command("dedupe-cache")
+def dedupe_cache():
+    """
+    Merge cache entries stored under non-canonical urls.
+
+    Entries written before search terms were normalized, e.g. NFD spellings or
+    unencoded umlauts, are moved to their canonical key or removed as duplicates.
+    Pages stored inline move to the content-addressed store, and pages no url
+    refers to any more are deleted.
+    """
+    downloader = clients.VerbformenClient.default_client().downloader
+    if not isinstance(downloader, CachedDownloader):
+        raise click.ClickException("dedupe-cache requires a cached downloader")
+    moved, removed = downloader.deduplicate()
+    console.print(f"moved {moved}, removed {removed} duplicate entries")
+
+
+@main.command()
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(FORMATS),
+    default="csv",
+    show_default=True,
+    help="parquet and arrow require pyarrow",
+)
+@click.option(
+    "--batch-size", default=1000, show_default=True, help="rows per record batch"
+)
+def export(directory: str, file_format: str, batch_size: int):
+    """
+    Export the cached dictionary to DIRECTORY.
+
+    Nouns, verbs, adjectives, declensions and conjugations are written to separate
+    files, streaming one page at a time.
+    """
+    client = clients.VerbformenClient.default_client()
+    if not isinstance(client.downloader, CachedDownloader):
+        raise click.ClickException("export requires a cached downloader")
+    try:
+        stats = export_cache(
+            client.downloader,
+            client.parser,
+            pathlib.Path(directory),
+            file_format,
+            batch_size,
+        )
+    except ImportError as e:
+        raise click.ClickException(str(e))
+    console.print(f"exported {stats.exported} entries, skipped {stats.skipped} pages")
+
+
+@main.command("cache-server")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8765, show_default=True)
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    help="sqlite database to serve, defaults to cache.db in the cache directory",
+)
+@click.option(
+    "--token",
+    default=lambda: settings.cache_token,
+    help="shared secret clients must send, defaults to CACHE_TOKEN",
+)
+def cache_server(host: str, port: int, db: Optional[str], token: Optional[str]):
+    """
+    Share a sqlite cache with other nodes over HTTP.
+
+    Point the workers at it with CACHE_BACKEND=http and CACHE_URL=http://HOST:PORT,
+    and the same CACHE_TOKEN. Anybody who can reach the server can overwrite the
+    pages every worker parses, so a token is required unless it only listens on
+    the loopback interface.
+    """
+    if not token and not ipaddress.ip_address(socket.gethostbyname(host)).is_loopback:
+        raise click.UsageError(f"serving on {host} requires --token or CACHE_TOKEN")
+    path = pathlib.Path(db) if db else settings.cache_dir / "cache.db"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    server = serve_cache(SqliteCacheBackend(path), host, port, token)
+    console.print(f"serving {path} on http://{host}:{server.server_address[1]}")
+    server.serve_forever()
+
+
+@main.command()
+def reparse():
+    """
+    Parse cached pages whose content or parser version changed.
+
+    Results of pages that were already parsed by the current parser are kept.
+    """
+    client = clients.VerbformenClient.default_client()
+    if not isinstance(client.parser, CachingParser) or not isinstance(
+        client.downloader, CachedDownloader
+    ):
+        raise click.ClickException("reparse requires cached pages and results")
+    stats = client.parser.reparse(client.downloader)
+    console.print(
+        f"parsed {stats.parsed}, up to date {stats.current}, failed {stats.failed},"
+        f" removed {stats.removed}"
+    )
+
+
+@main.command()
+@click.argument("file", type=click.File("r", encoding="UTF-8"))
+@click.option("--json", "as_json", is_flag=True, help="one json object per token")
+@click.option("--concurrency", default=8, show_default=True, help="parallel downloads")
+def annotate(file, as_json: bool, concurrency: int):
+    """
+    Annotate every word of a German text FILE ('-' for stdin).
+
+    Prints the part of speech, level and definitions of each token as soon as it
+    is resolved. Each distinct word is looked up once.
+    """
+    client = clients.VerbformenClient.default_client()
+    for annotation in client.annotate(file.read(), concurrency):
+        if as_json:
+            click.echo(annotation.json())
+            continue
+        pos = annotation.part_of_speech.value if annotation.part_of_speech else "-"
+        level = annotation.level.value if annotation.level else "-"
+        definitions = ", ".join(annotation.definitions[:max_definitions])
+        click.echo(
+            "\t".join(
+                [annotation.token, annotation.lemma or "-", pos, level, definitions]
+            )
+        )
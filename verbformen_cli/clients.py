@@ -1,30 +1,213 @@
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
 from verbformen_cli import parsers
+from verbformen_cli.cache_backends import create_backend
 from verbformen_cli.downloaders import (
     AbstractDownloader,
     create_search_url,
     CachedDownloader,
+    CircuitBreakerDownloader,
     Downloader,
+    DownloaderError,
+    Priority,
+    ScheduledDownloader,
+    download_priority,
 )
-from verbformen_cli.models import SearchResult, PartOfSpeech
-from verbformen_cli.parsers import AbstractParser
+from verbformen_cli.models import Annotation, Definition, SearchResult, PartOfSpeech
+from verbformen_cli.normalize import normalize_term
+from verbformen_cli.parsers import PARSE_ERRORS, AbstractParser
+from verbformen_cli.prefetch import RelatedPagePrefetcher
+from verbformen_cli.results import CachingParser
+from verbformen_cli.routing import PartOfSpeechRouter
 from verbformen_cli.settings import settings
 
+# endpoints queried by search_all_pos; adjectives are only served by the generic one
+SEARCH_HINTS = [None, PartOfSpeech.NOUN, PartOfSpeech.VERB]
+
+# words, including hyphenated compounds such as "E-Mail"
+TOKEN = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*")
+
 
 class VerbformenClient:
-    def __init__(self, downloader: AbstractDownloader, parser: AbstractParser):
+    def __init__(
+        self,
+        downloader: AbstractDownloader,
+        parser: AbstractParser,
+        router: Optional[PartOfSpeechRouter] = None,
+    ):
         self.downloader = downloader
         self.parser = parser
+        self.router = router
 
     def search(
-        self, german_word: str, part_of_speech: PartOfSpeech = None
+        self, german_word: str, part_of_speech: Optional[PartOfSpeech] = None
+    ) -> SearchResult:
+        url = self._search_url(german_word, part_of_speech)
+        return self._fetch(german_word, part_of_speech, url)
+
+    def search_all_pos(self, german_word: str) -> List[Definition]:
+        """
+        Every part of speech verbformen knows for ``german_word``, e.g. both the
+        verb "essen" and the noun "Essen".
+
+        The generic, noun and verb endpoints are downloaded concurrently; results
+        that resolve to the same dictionary entry are returned once. An endpoint
+        that fails to download is skipped unless all of them fail.
+        """
+        hints: Dict[str, Optional[PartOfSpeech]] = {}
+        for hint in SEARCH_HINTS:
+            # hints routed to the same url share one download
+            hints.setdefault(self._search_url(german_word, hint), hint)
+        with ThreadPoolExecutor(max_workers=len(hints)) as executor:
+            # downloads keep the priority of the caller
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, self._fetch, german_word, hint, url
+                )
+                for url, hint in hints.items()
+            ]
+
+        definitions: Dict[Tuple[PartOfSpeech, str], Definition] = {}
+        errors = []
+        for future in futures:
+            try:
+                result = future.result()
+            except DownloaderError as e:
+                errors.append(e)
+                continue
+            if isinstance(result, Definition):
+                key = (PartOfSpeech(result.part_of_speech), result.text)
+                definitions.setdefault(key, result)
+        if errors and len(errors) == len(futures):
+            raise errors[0]
+        return list(definitions.values())
+
+    def annotate(self, text: str, concurrency: int = 8) -> Iterator[Annotation]:
+        """
+        Annotate every word of a German ``text``, in order.
+
+        Tokens are normalized and deduplicated first, so each distinct word is
+        looked up once. Words already in the cache are resolved locally; the rest
+        are downloaded in one concurrent batch, at ``Priority.BATCH``, while
+        annotations are yielded.
+        """
+        tokens = [
+            (m.group(), m.start(), m.end(), normalize_term(m.group()))
+            for m in TOKEN.finditer(text)
+        ]
+        terms = list(dict.fromkeys(term for *_, term in tokens))
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            pending = {
+                term: executor.submit(self._lookup, term)
+                for term in terms
+                if not self._is_cached(term)
+            }
+            results: Dict[str, Optional[SearchResult]] = {}
+            for token, start, end, term in tokens:
+                if term not in results:
+                    future = pending.get(term)
+                    results[term] = future.result() if future else self._lookup(term)
+                yield _annotation(token, start, end, results[term])
+        finally:
+            # stop downloading when the caller stops reading
+            executor.shutdown(cancel_futures=True)
+
+    def _is_cached(self, german_word: str) -> bool:
+        if not isinstance(self.downloader, CachedDownloader):
+            return False
+        return self.downloader.is_fresh(self._search_url(german_word, None))
+
+    def _lookup(self, german_word: str) -> Optional[SearchResult]:
+        """search result, None if the page could not be downloaded or parsed"""
+        try:
+            with download_priority(Priority.BATCH):
+                return self.search(german_word)
+        except (DownloaderError, *PARSE_ERRORS):
+            return None
+
+    def _search_url(
+        self, german_word: str, part_of_speech: Optional[PartOfSpeech]
+    ) -> str:
+        if self.router:
+            url = self.router.resolve(german_word, part_of_speech)
+            if url:
+                return url
+        return create_search_url(german_word, part_of_speech)
+
+    def _fetch(
+        self, german_word: str, part_of_speech: Optional[PartOfSpeech], url: str
     ) -> SearchResult:
-        url = create_search_url(german_word, part_of_speech)
         html = self.downloader.download(url)
         result = self.parser.parse_page(html)
+        if self.router and isinstance(result, Definition):
+            self.router.learn(
+                german_word,
+                part_of_speech,
+                PartOfSpeech(result.part_of_speech),
+                url,
+                lemma=result.text,
+            )
         return result
 
     @classmethod
     def default_client(cls):
-        downloader = CachedDownloader(settings.cache_dir, Downloader())
-        parser = parsers.VerbformenParser()
-        return VerbformenClient(downloader, parser)
+        cache = create_backend(
+            settings.cache_backend,
+            settings.cache_url,
+            settings.cache_dir,
+            max_age=settings.cache_max_age,
+            token=settings.cache_token,
+        )
+        downloader = CachedDownloader(
+            cache,
+            CircuitBreakerDownloader(
+                ScheduledDownloader(
+                    Downloader(timeout=settings.download_timeout),
+                    connections=settings.download_connections,
+                    limits={Priority.PREFETCH: settings.prefetch_connections},
+                ),
+                failure_threshold=settings.circuit_breaker_threshold,
+                reset_timeout=settings.circuit_breaker_reset,
+            ),
+            max_age=settings.cache_max_age,
+            fragments=settings.cache_fragments,
+            negative_ttl=settings.negative_cache_ttl,
+            stale_while_revalidate=settings.cache_stale_while_revalidate,
+        )
+        router = PartOfSpeechRouter(cache)
+        related = None
+        if settings.prefetch_related_depth > 0:
+            related = RelatedPagePrefetcher(
+                downloader, max_depth=settings.prefetch_related_depth, router=router
+            )
+        parser = CachingParser(
+            parsers.VerbformenParser(
+                on_related=related.submit if related else None,
+                time_budget=settings.parse_time_budget,
+            ),
+            cache,
+        )
+        if related:
+            # prefetched pages land in the result cache under the same budget
+            related.parser = parser
+        return VerbformenClient(downloader, parser, router)
+
+
+def _annotation(
+    token: str, start: int, end: int, result: Optional[SearchResult]
+) -> Annotation:
+    if not isinstance(result, Definition):
+        return Annotation(token=token, start=start, end=end)
+    return Annotation(
+        token=token,
+        start=start,
+        end=end,
+        lemma=result.text,
+        part_of_speech=result.part_of_speech,
+        level=result.level,
+        definitions=result.definitions,
+    )
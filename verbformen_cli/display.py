@@ -1,36 +1,196 @@
-from typing import List
+import os
+import shlex
+import subprocess
+from typing import Iterable, List, Optional, Sequence, TextIO, Tuple, Union, cast
 
 from rich.align import Align
+from rich.columns import Columns
 from rich.console import Console
 from rich.console import Group
+from rich.console import RenderableType
 from rich.panel import Panel
 from rich.table import Table
 from rich.text import Text
 
+from verbformen_cli.metrics import metrics, MetricsRegistry
 from verbformen_cli.models import (
     Noun,
     Verb,
     Adjective,
     SearchResult,
     NotFound,
+    Conjugation,
     Declension,
 )
 
 console = Console()
 max_definitions = 5
 
+LAYOUTS = ["cards", "grid", "plain"]
+# minimum width of a card in the grid layout
+GRID_CARD_WIDTH = 40
+CASES = ["Nominative", "Accusative", "Dative", "Genitive"]
+PERSONS = ["ich", "du", "er", "wir", "ihr", "sie"]
+
 
 def display_summary(result: SearchResult, include_tables: bool):
-    if isinstance(result, NotFound):
-        console.print(
-            Panel(
-                Text("No results found", justify="center"),
-                title=result.search,
-                expand=True,
+    with metrics.timer("verbformen_display_seconds"):
+        _display_summary(console, result, include_tables)
+
+
+def display_summaries(
+    results: Iterable[SearchResult],
+    include_tables: bool = False,
+    layout: str = "cards",
+    pager: bool = False,
+    grid_columns: Optional[int] = None,
+) -> int:
+    """
+    Display many results as they arrive from ``results``.
+
+    Each card is written as soon as its result is available, and declension or
+    conjugation tables are only built for cards being written.
+
+    :param layout: "cards" for the centered cards of ``display_summary``, "grid"
+        for rows of cards side by side, or "plain" for a fast text-only rendering
+    :param pager: stream the output through ``$PAGER`` (default ``less -R``)
+    :param grid_columns: cards per row in the grid, by default as many as fit
+    :return: number of results displayed
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"unknown layout: {layout}")
+    if not pager:
+        return _display_summaries(
+            console, results, include_tables, layout, grid_columns
+        )
+
+    command = shlex.split(os.environ.get("PAGER") or "less -R")
+    process = subprocess.Popen(
+        command, stdin=subprocess.PIPE, encoding="UTF-8", errors="replace"
+    )
+    stdin = cast(TextIO, process.stdin)
+    paged = Console(file=stdin, force_terminal=console.is_terminal)
+    try:
+        return _display_summaries(paged, results, include_tables, layout, grid_columns)
+    except BrokenPipeError:
+        # the pager was closed before the end of the output
+        return 0
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+
+
+def _display_summaries(
+    target: Console,
+    results: Iterable[SearchResult],
+    include_tables: bool,
+    layout: str,
+    grid_columns: Optional[int],
+) -> int:
+    count = 0
+    if layout == "plain":
+        for result in results:
+            with metrics.timer("verbformen_display_seconds"):
+                target.file.write(plain_summary(result) + "\n")
+                if include_tables and not isinstance(result, NotFound):
+                    target.file.write(plain_table(result) + "\n")
+            count += 1
+        return count
+
+    if layout == "cards":
+        for result in results:
+            with metrics.timer("verbformen_display_seconds"):
+                _display_summary(target, result, include_tables)
+            count += 1
+        return count
+
+    per_row = grid_columns or max(1, target.width // GRID_CARD_WIDTH)
+    row: List[SearchResult] = []
+    for result in results:
+        row.append(result)
+        count += 1
+        if len(row) == per_row:
+            _display_grid_row(target, row, per_row, include_tables)
+            row = []
+    if row:
+        _display_grid_row(target, row, per_row, include_tables)
+    return count
+
+
+def _display_grid_row(
+    target: Console, row: List[SearchResult], per_row: int, include_tables: bool
+):
+    """cards side by side, followed by the tables of each card in the row"""
+    with metrics.timer("verbformen_display_seconds"):
+        target.print(
+            Columns(
+                [summary_card(r, centered=False) for r in row],
+                width=target.width // per_row - 1,
             )
         )
-        return
-    elif isinstance(result, Noun):
+        if include_tables:
+            for result in row:
+                if not isinstance(result, NotFound):
+                    target.print(Align.center(summary_table(result)))
+
+
+def _display_summary(target: Console, result: SearchResult, include_tables: bool):
+    target.print(summary_card(result))
+    if include_tables and not isinstance(result, NotFound):
+        target.print(Align.center(summary_table(result)))
+
+
+def summary_card(result: SearchResult, centered: bool = True) -> RenderableType:
+    if isinstance(result, NotFound):
+        return Panel(
+            Text("No results found", justify="center"),
+            title=result.search,
+            expand=True,
+        )
+    top_left, word, details = summary_lines(result)
+    group = Panel(
+        Group(
+            Text(top_left, style="dim"),
+            Text(word, justify="center", style="bold"),
+            Text(details, justify="center"),
+            Text(""),
+            Text(", ".join(result.definitions[0:max_definitions]), justify="center"),
+        ),
+        expand=not centered,
+        title=result.search,
+    )
+    return Align.center(group) if centered else group
+
+
+def plain_summary(result: SearchResult) -> str:
+    """summary card as plain text, without rich rendering"""
+    if isinstance(result, NotFound):
+        return f"{result.search}\n  No results found\n"
+    lines = [result.search, *summary_lines(result)]
+    lines.append(", ".join(result.definitions[0:max_definitions]))
+    return "\n  ".join(line for line in lines if line) + "\n"
+
+
+def plain_table(result: SearchResult) -> str:
+    """declension or conjugation table as tab separated text"""
+    columns: Sequence[Union[Conjugation, Declension]]
+    if isinstance(result, Verb):
+        title, keys, columns = "Conjugations", PERSONS, result.conjugations
+    elif isinstance(result, (Noun, Adjective)):
+        title, keys, columns = "Declensions", CASES, result.declensions
+    else:
+        raise ValueError()
+    lines = [title, "\t".join(["", *(c.title for c in columns)])]
+    lines += ["\t".join([key, *(getattr(c, key) for c in columns)]) for key in keys]
+    return "\n  ".join(lines) + "\n"
+
+
+def summary_lines(result: SearchResult) -> Tuple[str, str, str]:
+    """top left, word and details line of a summary card"""
+    if isinstance(result, Noun):
         level = result.level.value if result.level else None
         gender = result.gender.capitalize()
         endings = f"Endings: {result.genitive_ending}/{result.plural_ending}"
@@ -38,8 +198,6 @@ def display_summary(result: SearchResult, include_tables: bool):
         word = f"{result.article} {result.text}"
         details = f"{result.genitive} • {result.plural}"
 
-        table = declension_table(result.declensions)
-
     elif isinstance(result, Verb):
         level = result.level.value if result.level else None
         auxiliary = f"{result.auxiliary_verb}" + (
@@ -50,7 +208,6 @@ def display_summary(result: SearchResult, include_tables: bool):
         top_left = f"{level} • {result.behavior} • {auxiliary}"
         word = result.text
         details = f"{result.present} • {result.imperfect} • {result.perfect}"
-        table = conjugation_table(result.conjugations)
     elif isinstance(result, Adjective):
         top_left = (
             f"Endings: {result.comparative_ending}/{result.superlative_ending}"
@@ -63,23 +220,17 @@ def display_summary(result: SearchResult, include_tables: bool):
             if result.is_comparable
             else f"{result.text} • -- • --"
         )
-        table = declension_table(result.declensions)
     else:
         raise ValueError()
-    group = Panel(
-        Group(
-            Text(top_left, style="dim"),
-            Text(word, justify="center", style="bold"),
-            Text(details, justify="center"),
-            Text(""),
-            Text(", ".join(result.definitions[0:max_definitions]), justify="center"),
-        ),
-        expand=False,
-        title=result.search,
-    )
-    console.print(Align.center(group))
-    if include_tables:
-        console.print(Align.center(table))
+    return top_left, word, details
+
+
+def summary_table(result: SearchResult) -> Table:
+    if isinstance(result, Verb):
+        return conjugation_table(result.conjugations)
+    if isinstance(result, (Noun, Adjective)):
+        return declension_table(result.declensions)
+    raise ValueError()
 
 
 def declension_table(declensions: List[Declension]) -> Table:
@@ -111,3 +262,19 @@ def conjugation_table(conjugations):
     t.add_row("ihr", *[c.ihr for c in conjugations])
     t.add_row("sie", *[c.sie for c in conjugations])
     return t
+
+
+def display_profile(registry: MetricsRegistry = metrics):
+    """print the per-stage timing breakdown collected by ``registry``"""
+    t = Table()
+    t.title = "Profile"
+    t.show_header = True
+    t.add_column("Stage")
+    t.add_column("Calls", justify="right")
+    t.add_column("Total (ms)", justify="right")
+    t.add_column("Mean (ms)", justify="right")
+    for stage, calls, total in registry.stages():
+        t.add_row(
+            stage, str(calls), f"{total * 1000:.2f}", f"{total * 1000 / calls:.2f}"
+        )
+    console.print(Align.center(t))
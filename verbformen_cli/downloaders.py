@@ -1,13 +1,45 @@
 import abc
+import collections
+import contextlib
+import contextvars
+import enum
+import hashlib
 import pathlib
+import threading
+import time
 import urllib.parse
+from typing import Deque, Dict, Iterator, Optional, Set, Tuple, Union
 
 import requests
 
+from verbformen_cli.cache_backends import (
+    AbstractCacheBackend,
+    CacheEntry,
+    FilesystemCacheBackend,
+)
+from verbformen_cli.fragments import (
+    FRAGMENT_FORMAT_VERSION,
+    extract_fragment,
+    fragment_version,
+)
+from verbformen_cli.metrics import metrics
 from verbformen_cli.models import PartOfSpeech
+from verbformen_cli.normalize import cache_key, normalize_term
+
+
+# cache entries of urls hold this prefix and the hash of the stored page
+POINTER_PREFIX = "sha256:"
+# seconds unreferenced pages are kept before garbage collection deletes them
+GARBAGE_MIN_AGE = 600.0
 
 
 class DownloaderError(Exception):
+    def __init__(self, message: str = "", status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(DownloaderError):
     ...
 
 
@@ -18,32 +50,482 @@ class AbstractDownloader(abc.ABC):
 
 
 class Downloader(AbstractDownloader):
+    def __init__(self, timeout: Optional[float] = 10.0):
+        """
+        :param timeout: seconds to wait for the connection and for each read,
+            None to wait forever; a timeout raises ``DownloaderError``
+        """
+        self.timeout = timeout
+
     def download(self, url: str) -> str:
-        response = requests.get(url)
+        with metrics.timer("verbformen_download_seconds"):
+            try:
+                response = requests.get(url, timeout=self.timeout)
+            except requests.Timeout as e:
+                metrics.increment("verbformen_downloads_total", status="timeout")
+                raise DownloaderError(f"{url} timed out: {e}") from e
+            except requests.RequestException as e:
+                metrics.increment("verbformen_downloads_total", status="error")
+                raise DownloaderError(f"{url}: {e}") from e
+        metrics.increment(
+            "verbformen_downloads_total", status=str(response.status_code)
+        )
         if response.status_code != 200:
-            raise DownloaderError()
+            raise DownloaderError(
+                f"{url} returned {response.status_code}", response.status_code
+            )
         return response.text
 
 
+class CircuitBreakerDownloader(AbstractDownloader):
+    """
+    Fail fast while upstream is down.
+
+    After ``failure_threshold`` consecutive upstream failures (timeouts, connection
+    errors, 5xx and 429 responses) the circuit opens and every download raises
+    ``CircuitOpenError`` without a request. Other responses, including 4xx, show
+    upstream is up and do not count. Once ``reset_timeout`` seconds have passed a
+    single trial request is let through; it closes the circuit unless it fails.
+    """
+
+    def __init__(
+        self,
+        delegate: AbstractDownloader,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.delegate = delegate
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def download(self, url: str) -> str:
+        with self._lock:
+            if self.opened_at is not None:
+                if (
+                    self._trial
+                    or time.monotonic() - self.opened_at < self.reset_timeout
+                ):
+                    metrics.increment("verbformen_circuit_rejected_total")
+                    raise CircuitOpenError(f"circuit open, not downloading {url}")
+                self._trial = True
+        try:
+            page = self.delegate.download(url)
+        except DownloaderError as e:
+            with self._lock:
+                if _is_upstream_failure(e):
+                    self.failures += 1
+                    if (
+                        self.opened_at is not None
+                        or self.failures >= self.failure_threshold
+                    ):
+                        self.opened_at = time.monotonic()
+                else:
+                    # upstream answered, the request itself was refused
+                    self.failures = 0
+                    self.opened_at = None
+            raise
+        else:
+            with self._lock:
+                self.failures = 0
+                self.opened_at = None
+            return page
+        finally:
+            with self._lock:
+                self._trial = False
+
+
+def _is_upstream_failure(error: DownloaderError) -> bool:
+    """timeouts, connection errors, server errors and rate limiting"""
+    status_code = error.status_code
+    return status_code is None or status_code >= 500 or status_code == 429
+
+
+class Priority(enum.IntEnum):
+    """class of download traffic, most urgent first"""
+
+    INTERACTIVE = 0
+    BATCH = 1
+    PREFETCH = 2
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "verbformen_download_priority", default=Priority.INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def download_priority(priority: Priority):
+    """
+    Schedule the downloads made in the enclosed block, in this thread, as
+    ``priority`` traffic. Downloads are interactive by default.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+class ScheduledDownloader(AbstractDownloader):
+    """
+    Share ``connections`` concurrent downloads between traffic classes.
+
+    Each download runs with the ``current_priority`` of its caller. A freed
+    connection always goes to the most urgent waiting download whose class is
+    below its limit, oldest first, so an interactive lookup never queues behind
+    batch or prefetch traffic that has not started yet. Batch and prefetch
+    downloads together leave one connection free for interactive lookups,
+    unless there is only one connection.
+    """
+
+    def __init__(
+        self,
+        delegate: AbstractDownloader,
+        connections: int = 4,
+        limits: Optional[Dict[Priority, int]] = None,
+    ):
+        """
+        :param delegate: downloader doing the requests
+        :param connections: maximum downloads in flight across all classes
+        :param limits: maximum downloads in flight per class; by default batch
+            traffic may use every background connection and prefetching at most
+            half of all connections
+        """
+        self.delegate = delegate
+        self.connections = connections
+        # connections batch and prefetch traffic may use together
+        self.background_connections = max(1, connections - 1)
+        self.limits = {
+            Priority.INTERACTIVE: connections,
+            Priority.BATCH: self.background_connections,
+            Priority.PREFETCH: max(1, connections // 2),
+        } | (limits or {})
+        self.active: Dict[Priority, int] = {p: 0 for p in Priority}
+        self._waiting: Dict[Priority, Deque[threading.Event]] = {
+            p: collections.deque() for p in Priority
+        }
+        self._lock = threading.Lock()
+
+    def download(self, url: str) -> str:
+        priority = current_priority()
+        granted = threading.Event()
+        started = time.perf_counter()
+        with self._lock:
+            self._waiting[priority].append(granted)
+            self._grant()
+        try:
+            granted.wait()
+        except BaseException:
+            # interrupted while queued: give up the place or the connection
+            with self._lock:
+                if granted.is_set():
+                    self._release(priority)
+                else:
+                    self._waiting[priority].remove(granted)
+            raise
+        try:
+            metrics.observe(
+                "verbformen_download_queue_seconds",
+                time.perf_counter() - started,
+                priority=priority.name.lower(),
+            )
+            return self.delegate.download(url)
+        finally:
+            with self._lock:
+                self._release(priority)
+
+    def queued(self) -> Dict[Priority, int]:
+        """number of downloads waiting for a connection, per class"""
+        with self._lock:
+            return {p: len(waiting) for p, waiting in self._waiting.items()}
+
+    def _release(self, priority: Priority):
+        """free a connection of ``priority``; called with the lock held"""
+        self.active[priority] -= 1
+        self._grant()
+
+    def _grant(self):
+        """hand free connections to waiters; called with the lock held"""
+        for priority in Priority:
+            waiting = self._waiting[priority]
+            while waiting and self._can_start(priority):
+                self.active[priority] += 1
+                waiting.popleft().set()
+
+    def _can_start(self, priority: Priority) -> bool:
+        busy = sum(self.active.values())
+        background = busy - self.active[Priority.INTERACTIVE]
+        return (
+            busy < self.connections
+            and self.active[priority] < self.limits[priority]
+            and (
+                priority == Priority.INTERACTIVE
+                or background < self.background_connections
+            )
+        )
+
+
 class CachedDownloader(AbstractDownloader):
-    def __init__(self, cache_path: pathlib.Path, delegate: AbstractDownloader):
+    def __init__(
+        self,
+        cache: Union[pathlib.Path, AbstractCacheBackend],
+        delegate: AbstractDownloader,
+        max_age: Optional[float] = None,
+        fragments: bool = False,
+        negative_ttl: Optional[float] = None,
+        stale_while_revalidate: float = 0,
+        stale_if_error: bool = True,
+    ):
+        """
+        :param cache: backend storing one entry per downloaded url, or a directory
+            for a ``FilesystemCacheBackend``
+        :param delegate: downloader used on a cache miss
+        :param max_age: seconds before a cached page is downloaded again,
+            None to keep pages forever
+        :param fragments: store only the page regions the parser reads, see
+            ``fragments.extract_fragment``
+        :param negative_ttl: seconds a failed download is remembered and re-raised
+            without asking the delegate, None to not cache failures
+        :param stale_while_revalidate: seconds past ``max_age`` during which the
+            stale page is served while a background thread refreshes it
+        :param stale_if_error: serve an expired page when downloading it fails
+        """
+        if isinstance(cache, pathlib.Path):
+            cache = FilesystemCacheBackend(cache)
         self.delegate = delegate
-        self.cache_dir = cache_path
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
-    
+        self.cache = cache
+        self.max_age = max_age
+        self.fragments = fragments
+        self.negative_ttl = negative_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self._revalidating: Set[str] = set()
+        self._lock = threading.Lock()
+
     def download(self, url: str) -> str:
-        path = self.cache_dir / urllib.parse.quote(url, safe="")
-        if not path.is_file():
+        key = cache_key(url)
+        entry = self.cache.get(key)
+        age = time.time() - entry.stored_at if entry else None
+        if age is None:
+            result = "miss"
+        elif self.max_age is None or age < self.max_age:
+            result = "hit"
+        elif age < self.max_age + self.stale_while_revalidate:
+            result = "stale"
+        else:
+            result = "expired"
+        metrics.increment("verbformen_cache_requests_total", result=result)
+        with metrics.timer("verbformen_cache_download_seconds", result=result):
+            page = self._read(key, entry) if entry else None
+            if page is not None and result == "hit":
+                return page
+            if page is not None and result == "stale":
+                self._revalidate(url)
+                return page
+            try:
+                return self._fetch(url)
+            except DownloaderError:
+                if page is not None and self.stale_if_error:
+                    metrics.increment("verbformen_cache_stale_served_total")
+                    return page
+                raise
+
+    def _fetch(self, url: str) -> str:
+        """download ``url`` into the cache, remembering failures"""
+        key = cache_key(url)
+        error = self.cache.get(f"errors/{key}") if self.negative_ttl else None
+        if (
+            error
+            and self.negative_ttl
+            and time.time() - error.stored_at < self.negative_ttl
+        ):
+            metrics.increment("verbformen_cache_negative_hits_total")
+            raise DownloaderError(
+                f"{url} failed at {time.ctime(error.stored_at)}",
+                int(error.value) if error.value else None,
+            )
+        try:
             page = self.delegate.download(url)
-            path.write_text(page, encoding="UTF-8")
-        return path.read_text(encoding="UTF-8")
+        except CircuitOpenError:
+            raise
+        except DownloaderError as e:
+            if self.negative_ttl:
+                self.cache.set(f"errors/{key}", str(e.status_code or ""))
+            raise
+        if self.fragments:
+            page = extract_fragment(page)
+        self._store(key, page)
+        if error:
+            self.cache.delete(f"errors/{key}")
+        return page
+
+    def _revalidate(self, url: str):
+        """refresh ``url`` in a background thread, at most once at a time"""
+        with self._lock:
+            if url in self._revalidating:
+                return
+            self._revalidating.add(url)
+
+        def refresh():
+            try:
+                with download_priority(Priority.PREFETCH):
+                    self._fetch(url)
+            except DownloaderError:
+                pass
+            finally:
+                with self._lock:
+                    self._revalidating.discard(url)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _store(self, key: str, page: str, stored_at: Optional[float] = None):
+        """store ``page`` once under its content hash and point ``key`` at it"""
+        digest = content_hash(page)
+        self.cache.set(f"pages/{digest}", page)
+        self.cache.set(key, POINTER_PREFIX + digest, stored_at)
+
+    def _read(self, key: str, entry: CacheEntry) -> Optional[str]:
+        """cached page, None if it has to be downloaded again"""
+        page = self._dereference(entry.value)
+        if page is None or not self.fragments:
+            return page
+        version = fragment_version(page)
+        if version == FRAGMENT_FORMAT_VERSION:
+            return page
+        if version is not None:
+            return None
+        # full page cached without fragments, convert it in place
+        fragment = extract_fragment(page)
+        self._store(key, fragment, stored_at=entry.stored_at)
+        return fragment
+
+    def _dereference(self, value: str) -> Optional[str]:
+        if not value.startswith(POINTER_PREFIX):
+            # page stored inline by versions before content hashing
+            return value
+        blob = self.cache.get(f"pages/{value[len(POINTER_PREFIX):]}")
+        return blob.value if blob else None
+
+    def is_fresh(self, url: str) -> bool:
+        """whether ``url`` is cached and younger than ``max_age``"""
+        entry = self.cache.get(cache_key(url))
+        if entry is None:
+            return False
+        return self.max_age is None or time.time() - entry.stored_at < self.max_age
+
+    def cached_urls(self) -> Iterator[str]:
+        for key in self._url_keys():
+            yield urllib.parse.unquote(key)
+
+    def _url_keys(self) -> Iterator[str]:
+        """top-level keys of cached urls, skipping unrelated files in the cache"""
+        for key in self.cache.keys():
+            if urllib.parse.unquote(key).startswith("http"):
+                yield key
+
+    def content_hashes(self) -> Iterator[str]:
+        """hash of every distinct cached page"""
+        return self.cache.keys("pages")
+
+    def cached_pages(self) -> Iterator[Tuple[str, str]]:
+        """(content hash, page) of every distinct cached page"""
+        seen = set()
+        for digest in self.content_hashes():
+            blob = self.cache.get(f"pages/{digest}")
+            if blob:
+                seen.add(digest)
+                yield digest, blob.value
+        for key in self._url_keys():
+            entry = self.cache.get(key)
+            if entry is None or entry.value.startswith(POINTER_PREFIX):
+                continue
+            digest = content_hash(entry.value)
+            if digest not in seen:
+                seen.add(digest)
+                yield digest, entry.value
+
+    def deduplicate(self) -> Tuple[int, int]:
+        """
+        Merge duplicate entries:
+
+        - entries written under non-canonical keys, e.g. by versions that did not
+          normalize urls, move to their canonical key, or are deleted where the
+          canonical entry already exists
+        - pages stored inline by versions before content hashing move to the
+          content-addressed store
+        - stored pages and parsed results no url points to are deleted
+
+        :return: number of entries moved and removed
+        """
+        moved = removed = 0
+        for key in list(self._url_keys()):
+            url = urllib.parse.unquote(key)
+            entry = self.cache.get(key)
+            if entry is None:
+                continue
+            target = cache_key(url)
+            inline = not entry.value.startswith(POINTER_PREFIX)
+            if target == key and not inline:
+                continue
+            if target != key and self.cache.get(target) is not None:
+                self.cache.delete(key)
+                removed += 1
+                continue
+            if inline:
+                self._store(target, entry.value, entry.stored_at)
+            else:
+                self.cache.set(target, entry.value, entry.stored_at)
+            if target != key:
+                self.cache.delete(key)
+            moved += 1
+        return moved, removed + self.collect_garbage(min_age=0)
+
+    def collect_garbage(self, min_age: float = GARBAGE_MIN_AGE) -> int:
+        """
+        Delete stored pages and parsed results no url points to any more, e.g.
+        earlier versions of refreshed pages.
+
+        :param min_age: seconds an entry is kept after it was written, so pages
+            stored by concurrent writers before their url points to them survive
+        :return: number of entries removed
+        """
+        referenced = {
+            entry.value[len(POINTER_PREFIX) :]
+            for entry in map(self.cache.get, list(self._url_keys()))
+            if entry and entry.value.startswith(POINTER_PREFIX)
+        }
+        removed = 0
+        for namespace in ["pages", "results"]:
+            for digest in list(self.cache.keys(namespace)):
+                if digest in referenced:
+                    continue
+                entry = self.cache.get(f"{namespace}/{digest}")
+                if entry and time.time() - entry.stored_at >= min_age:
+                    self.cache.delete(f"{namespace}/{digest}")
+                    removed += 1
+        return removed
+
+
+def content_hash(page: str) -> str:
+    return hashlib.sha256(page.encode("UTF-8")).hexdigest()
 
 
-def create_search_url(german_word: str, part_of_speech: PartOfSpeech = None) -> str:
+def create_search_url(
+    german_word: str, part_of_speech: Optional[PartOfSpeech] = None
+) -> str:
     if part_of_speech == PartOfSpeech.NOUN:
         base = "https://www.verbformen.com/declension/nouns/?w="
     elif part_of_speech == PartOfSpeech.VERB:
         base = "https://www.verbformen.com/conjugation/?w="
     else:
         base = "https://www.verbformen.com/?w="
-    return f"{base}{german_word}"
+    word = normalize_term(german_word, part_of_speech)
+    return f"{base}{urllib.parse.quote(word, safe='')}"
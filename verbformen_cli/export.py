@@ -0,0 +1,253 @@
+import abc
+import csv
+import pathlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from verbformen_cli.downloaders import CachedDownloader
+from verbformen_cli.models import Adjective, Definition, Noun, Verb
+from verbformen_cli.parsers import PARSE_ERRORS, AbstractParser
+
+DEFINITION_COLUMNS = [
+    ("search", "string"),
+    ("text", "string"),
+    ("level", "string"),
+    ("definitions", "list"),
+]
+CASE_COLUMNS = [
+    (c, "string") for c in ["Nominative", "Accusative", "Dative", "Genitive"]
+]
+PERSON_COLUMNS = [(c, "string") for c in ["ich", "du", "er", "wir", "ihr", "sie"]]
+
+# table name -> (column name, column type)
+TABLES: Dict[str, List[Tuple[str, str]]] = {
+    "nouns": DEFINITION_COLUMNS
+    + [
+        (c, "string")
+        for c in [
+            "genitive",
+            "plural",
+            "genitive_ending",
+            "plural_ending",
+            "gender",
+            "article",
+        ]
+    ],
+    "verbs": DEFINITION_COLUMNS
+    + [
+        (c, "string")
+        for c in [
+            "behavior",
+            "present",
+            "imperfect",
+            "perfect",
+            "auxiliary_verb",
+            "secondary_auxiliary_verb",
+            "flection",
+            "use",
+            "separable_prefix",
+            "non_separable_prefix",
+        ]
+    ],
+    "adjectives": DEFINITION_COLUMNS
+    + [("is_comparable", "bool")]
+    + [
+        (c, "string")
+        for c in [
+            "comparative",
+            "superlative",
+            "comparative_ending",
+            "superlative_ending",
+        ]
+    ],
+    "declensions": [
+        ("part_of_speech", "string"),
+        ("text", "string"),
+        ("title", "string"),
+    ]
+    + CASE_COLUMNS,
+    "conjugations": [("text", "string"), ("title", "string")] + PERSON_COLUMNS,
+}
+
+FORMATS = ["csv", "parquet", "arrow"]
+
+Row = Dict[str, object]
+
+
+class ExportStats(BaseModel):
+    exported: int = 0
+    skipped: int = 0
+
+
+class TableWriter(abc.ABC):
+    """Buffers rows of one table and writes them in batches of ``batch_size``."""
+
+    def __init__(self, columns: List[Tuple[str, str]], batch_size: int):
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows: List[Row] = []
+
+    def write(self, row: Row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self._write_batch(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    @abc.abstractmethod
+    def _write_batch(self, rows: List[Row]):
+        ...
+
+    @abc.abstractmethod
+    def _close(self):
+        ...
+
+
+class CsvTableWriter(TableWriter):
+    def __init__(self, path: pathlib.Path, columns, batch_size: int):
+        super().__init__(columns, batch_size)
+        self.file = path.open("w", encoding="UTF-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def _write_batch(self, rows: List[Row]):
+        self.writer.writerows(
+            [
+                "; ".join(v) if isinstance(v, list) else v
+                for v in (row.get(name) for name, _ in self.columns)
+            ]
+            for row in rows
+        )
+
+    def _close(self):
+        self.file.close()
+
+
+class ArrowTableWriter(TableWriter):
+    """parquet or arrow ipc file, one record batch per ``batch_size`` rows"""
+
+    def __init__(self, path: pathlib.Path, columns, batch_size: int, file_format: str):
+        super().__init__(columns, batch_size)
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(
+                f"{file_format} export requires pyarrow: "
+                "pip install 'verbformen-cli[export]'"
+            ) from e
+        types = {
+            "string": pa.string(),
+            "bool": pa.bool_(),
+            "list": pa.list_(pa.string()),
+        }
+        self.pa = pa
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        if file_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(str(path), self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(str(path), self.schema)
+
+    def _write_batch(self, rows: List[Row]):
+        self.writer.write_batch(
+            self.pa.RecordBatch.from_pylist(rows, schema=self.schema)
+        )
+
+    def _close(self):
+        self.writer.close()
+
+
+def open_writers(
+    directory: pathlib.Path, file_format: str, batch_size: int
+) -> Dict[str, TableWriter]:
+    directory.mkdir(parents=True, exist_ok=True)
+    writers: Dict[str, TableWriter] = {}
+    for name, columns in TABLES.items():
+        path = directory / f"{name}.{file_format}"
+        if file_format == "csv":
+            writers[name] = CsvTableWriter(path, columns, batch_size)
+        else:
+            writers[name] = ArrowTableWriter(path, columns, batch_size, file_format)
+    return writers
+
+
+def export_cache(
+    downloader: CachedDownloader,
+    parser: AbstractParser,
+    directory: pathlib.Path,
+    file_format: str = "csv",
+    batch_size: int = 1000,
+) -> ExportStats:
+    """
+    Stream every cached dictionary entry into one file per table.
+
+    Pages are parsed one at a time and rows are written in batches, so memory
+    use depends on ``batch_size``, not on the size of the cache. Pages that are
+    not found or fail to parse are skipped.
+    """
+    return write_tables(
+        iter_definitions(downloader, parser), directory, file_format, batch_size
+    )
+
+
+def iter_definitions(
+    downloader: CachedDownloader, parser: AbstractParser
+) -> Iterator[Optional[Definition]]:
+    """parsed entry of each distinct cached page, None for pages without one"""
+    for _, page in downloader.cached_pages():
+        try:
+            result = parser.parse_page(page)
+        except PARSE_ERRORS:
+            result = None
+        yield result if isinstance(result, Definition) else None
+
+
+def write_tables(
+    definitions: Iterable[Optional[Definition]],
+    directory: pathlib.Path,
+    file_format: str = "csv",
+    batch_size: int = 1000,
+) -> ExportStats:
+    stats = ExportStats()
+    writers = open_writers(directory, file_format, batch_size)
+    try:
+        for definition in definitions:
+            if definition is None:
+                stats.skipped += 1
+                continue
+            for table, row in definition_rows(definition):
+                writers[table].write(row)
+            stats.exported += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return stats
+
+
+def definition_rows(definition: Definition) -> Iterator[Tuple[str, Row]]:
+    """(table, row) pairs for one dictionary entry and its tables"""
+    row = definition.dict(exclude={"declensions", "conjugations", "part_of_speech"})
+    row["level"] = definition.level.value if definition.level else None
+    if isinstance(definition, Noun):
+        yield "nouns", row
+    elif isinstance(definition, Verb):
+        yield "verbs", row
+    elif isinstance(definition, Adjective):
+        yield "adjectives", row
+    for declension in getattr(definition, "declensions", []):
+        pos = "noun" if isinstance(definition, Noun) else "adjective"
+        yield "declensions", {
+            "part_of_speech": pos,
+            "text": definition.text,
+        } | declension.dict()
+    for conjugation in getattr(definition, "conjugations", []):
+        yield "conjugations", {"text": definition.text} | conjugation.dict()
@@ -0,0 +1,76 @@
+import re
+from typing import List, Optional
+
+from bs4 import BeautifulSoup, Tag
+
+# bump whenever the extracted regions change, so older fragments are refetched
+FRAGMENT_FORMAT_VERSION = 1
+FRAGMENT_MARKER = "verbformen-fragment"
+
+# regions read by VerbformenParser
+DESCRIPTION_TEXT = re.compile(
+    "declension of the noun|declension of the adjective|conjugation of the verb"
+)
+TABLE_TITLES = {
+    "Singular",
+    "Plural",
+    "Masculine",
+    "Neutral",
+    "Feminine",
+    "Present",
+    "Imperfect",
+    "Present Subj.",
+    "Imperf. Subj.",
+}
+
+
+def extract_fragment(html: str) -> str:
+    """
+    Strip a verbformen page down to the regions the parser reads: the meta
+    description, the search input, the summary box, the description paragraph
+    and the declension/conjugation tables. Regions keep their document order.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    head: List[Tag] = [
+        t for t in [soup.find("meta", attrs={"name": "description"})] if t
+    ]
+
+    regions: List[Tag] = []
+    candidates = [
+        soup.find("input", type="search"),
+        soup.find(class_="rAbschnitt"),
+    ]
+    description = soup.find(string=DESCRIPTION_TEXT)
+    if description and description.parent and description.parent.parent:
+        candidates.append(description.parent.parent)
+    candidates += [h2 for h2 in soup.find_all("h2") if h2.get_text() in TABLE_TITLES]
+    for tag in candidates:
+        if tag is None or any(_contains(region, tag) for region in regions):
+            continue
+        regions = [r for r in regions if not _contains(tag, r)] + [tag]
+    regions.sort(key=lambda t: (t.sourceline or 0, t.sourcepos or 0))
+
+    body = "".join(_render(tag) for tag in regions)
+    return (
+        f'<html><head><meta name="{FRAGMENT_MARKER}"'
+        f' content="{FRAGMENT_FORMAT_VERSION}"/>'
+        f'{"".join(map(str, head))}</head><body>{body}</body></html>'
+    )
+
+
+def fragment_version(html: str) -> Optional[int]:
+    """format version of a fragment, None for a full page"""
+    match = re.search(f'<meta name="{FRAGMENT_MARKER}" content="(\\d+)"/>', html[:200])
+    return int(match.group(1)) if match else None
+
+
+def _contains(outer: Tag, inner: Tag) -> bool:
+    return outer is inner or any(p is outer for p in inner.parents)
+
+
+def _render(tag: Tag) -> str:
+    if tag.name == "h2":
+        # the parser looks up the table as a sibling of its header
+        table = tag.find_next_sibling("table")
+        return f"<div>{tag}{table or ''}</div>"
+    return str(tag)
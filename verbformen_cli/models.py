@@ -107,3 +107,15 @@ class NotFound(BaseModel):
 
 
 SearchResult = Union[Definition, NotFound]
+
+
+class Annotation(BaseModel):
+    token: str = Field(description="word as it appears in the text", example="Hunde")
+    start: int = Field(description="offset of the token in the text")
+    end: int
+    lemma: Optional[str] = Field(
+        description="dictionary word", example="Hund", default=None
+    )
+    part_of_speech: Optional[PartOfSpeech] = None
+    level: Optional[Level] = None
+    definitions: List[str] = []
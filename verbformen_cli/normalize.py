@@ -0,0 +1,50 @@
+import re
+import unicodedata
+import urllib.parse
+from typing import Optional
+
+from verbformen_cli.models import PartOfSpeech
+
+# parts of speech whose dictionary form is lower case
+LOWER_CASE = {PartOfSpeech.VERB, PartOfSpeech.ADJECTIVE, PartOfSpeech.ADVERB}
+
+
+def normalize_term(
+    word: str,
+    part_of_speech: Optional[PartOfSpeech] = None,
+    fold_sharp_s: bool = False,
+) -> str:
+    """
+    Canonical spelling of a search term.
+
+    Applies NFC normalization and collapses whitespace. With a part of speech the
+    case is folded too: nouns are capitalized, other parts of speech lower cased.
+    Without one the case is kept, since "essen" and "Essen" are different words.
+    "ß" only folds to "ss" on request, as it would merge words like "Maße" and
+    "Masse".
+    """
+    text = re.sub(r"\s+", " ", unicodedata.normalize("NFC", word)).strip()
+    if fold_sharp_s:
+        text = text.replace("ß", "ss")
+    if part_of_speech == PartOfSpeech.NOUN:
+        text = text[:1].upper() + text[1:]
+    elif part_of_speech in LOWER_CASE:
+        text = text.lower()
+    return text
+
+
+def canonical_url(url: str) -> str:
+    """``url`` with its query NFC normalized and consistently percent-encoded"""
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    query = [(k, unicodedata.normalize("NFC", v)) for k, v in query]
+    return urllib.parse.urlunsplit(
+        parts._replace(
+            query=urllib.parse.urlencode(query, quote_via=urllib.parse.quote)
+        )
+    )
+
+
+def cache_key(url: str) -> str:
+    """file system safe key identifying the page at ``url``"""
+    return urllib.parse.quote(canonical_url(url), safe="")
@@ -1,7 +1,11 @@
 import abc
 import re
-from typing import Optional, List, Dict
+import time
+import urllib.parse
+from typing import Callable, Optional, List, Dict
 
+from verbformen_cli.downloaders import create_search_url
+from verbformen_cli.metrics import metrics
 from verbformen_cli.models import (
     PartOfSpeech,
     Level,
@@ -21,49 +25,207 @@ class ParseError(Exception):
     ...
 
 
+# unexpected page layouts surface as lookup errors from BeautifulSoup
+PARSE_ERRORS = (ParseError, AttributeError, KeyError, TypeError, ValueError)
+
+
 class AbstractParser(abc.ABC):
+    # identifies the parse output; cached results of other versions are re-parsed
+    version = "0"
+
     @abc.abstractmethod
     def parse_page(self, html: str) -> SearchResult:
         ...
 
 
+RELATED_PATHS = {
+    "/conjugation/": PartOfSpeech.VERB,
+    "/declension/nouns/": PartOfSpeech.NOUN,
+    "/declension/adjectives/": None,
+}
+
+# The description patterns run in linear time: every variable part is delimited
+# by a character it cannot contain, and every optional sentence starts with
+# distinct words, so a description that does not match fails without
+# backtracking over earlier parts.
+
+# translation after the word, with at most one level of nested parentheses
+PARENTHETICAL = r"\([^()]*(?:\([^()]*\)[^()]*)*\)"
+
+NOUN_PATTERN = re.compile(
+    rf"The declension of the noun (?P<text>\S+) {PARENTHETICAL} is in singular "
+    r"genitive (?P<genitive>\S+) and in the plural nominative (?P<plural>\S+)\. "
+    r"The noun (?P=text) is declined with the declension endings "
+    r"(?P<genitive_ending>[^\s/]+)/(?P<plural_ending>\S+?)\. "
+    r"(?:It can also be used with other endings\. )?"
+    r"(?:In the plural is an umlaut\. )?"
+    r"(?:It does not form plurals\. )?"
+    r"(?:In the plural forms of (?P<possible_plural>\S+?) are possible\. )?"
+    r"The voice of (?P=text) is (?P<gender>[a-z]+) and the article "
+    r'"(?P<article>(der)|(die)|(das))"\. '
+    r"(?:The noun can also be used with other genus and other articles\. )?"
+    r"Here you can not only inflect (?P=text) but also all German nouns\. "
+    r"(?:The noun is part of the thesaurus of Zertifikat Deutsch respectivly "
+    r"Level (?P<level>\w{2})\.)?"
+)
+
+VERB_PATTERN = re.compile(
+    rf"The conjugation of the verb (?P<text>\S+) {PARENTHETICAL} is "
+    r"(?P<behavior>\S+)\. "
+    r"Basic forms are (?P<present>[^,.]+), (?P<imperfect>(?:(?! and )[^,.])+) and "
+    r"(?P<perfect>[^,.]+)\. "
+    r"(?:The stem vowels are ([^.]+)\. )?"
+    r"(?:Can be used regularly as well\. )?"
+    r"The auxiliary verb of (?P=text) is (?P<auxiliary_verb>\S+?)\. "
+    r"(?:(?P<secondary_auxiliary_verb>\S+) can be used as well\. )?"
+    r"(?:First syllable (?P<separable_prefix>\S+) of "
+    r"(?P=text) is separable\. )?"
+    r"(?:Can also be used not separable\. )?"
+    r"(?:Prefix (?P<non_separable_prefix>\S+) of (?P=text) is not"
+    r" separable\. )?"
+    r"(?:Can also be used separable\. )?"
+    r"The flection is in (?P<flection>\S+) and the use as (?P<use>\S+)\. "
+    r"For a better understanding, countless examples of the verb (?P=text) are"
+    r" available\. "
+    r"For practicing and consolidating, there are also free worksheets for"
+    r" (?P=text)\. "
+    r"You can not just (?P=text) conjugate, but all German verbs\. "
+    r"(?:The verb is part of the thesaurus of Zertifikat Deutsch respectivly"
+    r" Level"
+    r" (?P<level>\w{2})\.)?"
+)
+
+INCOMPARABLE_ADJECTIVE_PATTERN = re.compile(
+    rf"The declension of the adjective (?P<text>\S+) {PARENTHETICAL} uses the "
+    r"incomparable form (?P=text)\. "
+    r"The adjective has no forms for the comparative and superlative\. "
+    r"The adjective (?P=text) can be used both attributively in front of a noun"
+    r" as well as predicative in conjunction with a verb\."
+    r"One can not only inflect and compare (?P=text), but all German"
+    r" adjectives\."
+)
+
+COMPARABLE_ADJECTIVE_PATTERN = re.compile(
+    rf"The declension of the adjective (?P<text>\S+) {PARENTHETICAL} uses these "
+    r"forms of the comparison (?P=text),(?P<comparative>[^\s,]+),"
+    r"(?P<superlative>[^,.]+)\. "
+    r"The endings for the comparison in the comparative and superlative are"
+    r" (?P<comparative_ending>[^\s/]+)/(?P<superlative_ending>\S+?)\. "
+    r"The adjective (?P=text) can be used both attributively in front of a noun"
+    r" as well as predicative in conjunction with a verb\."
+    r"One can not only inflect and compare (?P=text), but all German"
+    r" adjectives\."
+)
+
+
 class VerbformenParser(AbstractParser):
+    # bump whenever a change alters the results parsed from the same page
+    version = "1"
+
+    def __init__(
+        self,
+        on_related: Optional[Callable[[List[str]], None]] = None,
+        time_budget: Optional[float] = None,
+        max_description_length: int = 4000,
+    ):
+        """
+        :param on_related: called with the search urls of the noun/verb/adjective
+            variants linked from each parsed page, e.g. a prefetch queue
+        :param time_budget: seconds a page may take to parse, None for no limit;
+            checked between parse stages
+        :param max_description_length: longer description paragraphs are rejected
+            instead of matched
+        """
+        self.on_related = on_related
+        self.time_budget = time_budget
+        self.max_description_length = max_description_length
+
     def parse_page(self, html: str) -> SearchResult:
-        soup = BeautifulSoup(html, "html.parser")
+        with metrics.timer("verbformen_parse_seconds", stage="total"):
+            return self._parse_page(html)
+
+    def _parse_page(self, html: str) -> SearchResult:
+        started = time.perf_counter()
+        with metrics.timer("verbformen_parse_seconds", stage="soup"):
+            soup = BeautifulSoup(html, "html.parser")
         search = self._parse_search(soup)
+        self._check_budget(started, search, "soup")
         if self._not_found(soup):
             return NotFound(**{"search": search})
-
-        part_of_speech = self._parse_part_of_speech(soup)
-        description = self._description_paragraph(soup, part_of_speech)
-        definitions = {
-            "definitions": self._parse_definitions(soup),
-            "search": self._parse_search(soup),
-        }
-        if part_of_speech == PartOfSpeech.NOUN:
-            return Noun(
-                **self._extract_noun_data(description) | definitions,
-                declensions=self._parse_declensions(soup, ["Singular", "Plural"]),
+        if self.on_related:
+            self.on_related(self._parse_related_links(soup))
+
+        with metrics.timer("verbformen_parse_seconds", stage="summary"):
+            part_of_speech = self._parse_part_of_speech(soup)
+            description = self._description_paragraph(soup, part_of_speech)
+            definitions = {
+                "definitions": self._parse_definitions(soup),
+                "search": self._parse_search(soup),
+            }
+        if len(description) > self.max_description_length:
+            raise ParseError(
+                f"description of {search} is longer than"
+                f" {self.max_description_length} characters"
             )
+        self._check_budget(started, search, "summary")
+        if part_of_speech == PartOfSpeech.NOUN:
+            with metrics.timer("verbformen_parse_seconds", stage="extract"):
+                data = self._extract_noun_data(description)
+            self._check_budget(started, search, "extract")
+            with metrics.timer("verbformen_parse_seconds", stage="tables"):
+                declensions = self._parse_declensions(soup, ["Singular", "Plural"])
+            return Noun(**data | definitions, declensions=declensions)
 
         elif part_of_speech == PartOfSpeech.VERB:
-            return Verb(
-                **self._extract_verb_data(description) | definitions,
-                conjugations=self._parse_conjugations(
+            with metrics.timer("verbformen_parse_seconds", stage="extract"):
+                data = self._extract_verb_data(description)
+            self._check_budget(started, search, "extract")
+            with metrics.timer("verbformen_parse_seconds", stage="tables"):
+                conjugations = self._parse_conjugations(
                     soup, ["Present", "Imperfect", "Present Subj.", "Imperf. Subj."]
-                ),
-            )
+                )
+            return Verb(**data | definitions, conjugations=conjugations)
 
         elif part_of_speech == PartOfSpeech.ADJECTIVE:
-            return Adjective(
-                **self._extract_adjective_data(description) | definitions,
-                declensions=self._parse_declensions(
+            with metrics.timer("verbformen_parse_seconds", stage="extract"):
+                data = self._extract_adjective_data(description)
+            self._check_budget(started, search, "extract")
+            with metrics.timer("verbformen_parse_seconds", stage="tables"):
+                declensions = self._parse_declensions(
                     soup, ["Masculine", "Neutral", "Feminine", "Plural"]
-                ),
-            )
+                )
+            return Adjective(**data | definitions, declensions=declensions)
         else:
             raise ValueError()
 
+    def _check_budget(self, started: float, search: str, stage: str):
+        if self.time_budget is None:
+            return
+        elapsed = time.perf_counter() - started
+        if elapsed > self.time_budget:
+            metrics.increment("verbformen_parse_budget_exceeded_total", stage=stage)
+            raise ParseError(
+                f"parsing {search} exceeded its time budget of {self.time_budget}s"
+                f" ({elapsed:.3f}s after the {stage} stage)"
+            )
+
+    def extract_related_links(self, html: str) -> List[str]:
+        """search urls of the word variants linked from a page"""
+        soup = BeautifulSoup(html, "html.parser")
+        if self._not_found(soup):
+            return []
+        return self._parse_related_links(soup)
+
+    def _parse_related_links(self, soup: BeautifulSoup) -> List[str]:
+        container = soup.find(class_="rAbschnitt")
+        if not container:
+            return []
+        urls = [
+            related_search_url(str(a["href"]))
+            for a in container.find_all("a", href=True)
+        ]
+        return list(dict.fromkeys(url for url in urls if url))
+
     def _not_found(self, soup: BeautifulSoup) -> bool:
         content = soup.find("meta", attrs={"name": "description"})["content"]
         return "German words with" in content
@@ -93,27 +255,11 @@ class VerbformenParser(AbstractParser):
             raise ValueError(f"unexpected PartOfSpeech: {part_of_speech}")
 
         return clean_whitespace(
-            soup.find(text=re.compile(f".*{regex}.*")).parent.parent.get_text()
+            soup.find(text=re.compile(regex)).parent.parent.get_text()
         )
 
     def _extract_noun_data(self, description) -> Dict[str, str]:
-        regex = re.match(
-            r"The declension of the noun (?P<text>\S+) (?:\(.*\)) is in singular genitive "
-            r"(?P<genitive>\S+) and in the plural nominative (?P<plural>\S+). "
-            r"The noun (?P=text) is declined with the declension endings "
-            r"(?P<genitive_ending>\S+)/(?P<plural_ending>\S+?). "
-            r"(?:It can also be used with other endings\. )?"
-            r"(?:In the plural is an umlaut\. )?"
-            r"(?:It does not form plurals\. )?"
-            r"(?:In the plural forms of (?P<possible_plural>\S+?) are possible\. )?"
-            r"The voice of (?P=text) is (?P<gender>[a-z]+) and the article "
-            r'"(?P<article>(der)|(die)|(das))"\. '
-            r"(?:The noun can also be used with other genus and other articles\. )?"
-            r"Here you can not only inflect (?P=text) but also all German nouns\. "
-            r"(?:The noun is part of the thesaurus of Zertifikat Deutsch respectivly "
-            r"Level (?P<level>\w{2})\.)?",
-            description,
-        )
+        regex = NOUN_PATTERN.match(description)
         if not regex:
             raise ParseError(f"Parse Error:\n{description}")
         return regex.groupdict()
@@ -156,61 +302,15 @@ class VerbformenParser(AbstractParser):
         return d
 
     def _extract_verb_data(self, description) -> Dict[str, str]:
-        regex = re.match(
-            r"^The conjugation of the verb (?P<text>\S+) (?:\(.*\)) is (?P<behavior>\S+)\. "
-            r"Basic forms are (?P<present>[\S ]+), (?P<imperfect>[\S ]+) and "
-            r"(?P<perfect>[\S ]+?)\. "  # non-greedy for optional next line
-            r"(?:The stem vowels are ([\S ]+)\. )?"
-            r"(?:Can be used regularly as well\. )?"
-            r"The auxiliary verb of (?P=text) is (?P<auxiliary_verb>\S+?)\. "
-            r"(?:(?P<secondary_auxiliary_verb>\S+) can be used as well\. )?"
-            r"(?:First syllable (?P<separable_prefix>[\S-]+) of "
-            r"(?P=text) is separable\. )?"
-            r"(?:Can also be used not separable\. )?"
-            r"(?:Prefix (?P<non_separable_prefix>[\S-]+) of (?P=text) is not"
-            r" separable\. )?"
-            r"(?:Can also be used separable\. )?"
-            r"The flection is in (?P<flection>\S+) and the use as (?P<use>\S+)\. "
-            r"For a better understanding, countless examples of the verb (?P=text) are"
-            r" available\. "
-            r"For practicing and consolidating, there are also free worksheets for"
-            r" (?P=text)\. "
-            r"You can not just (?P=text) conjugate, but all German verbs\. "
-            r"(?:The verb is part of the thesaurus of Zertifikat Deutsch respectivly"
-            r" Level"
-            r" (?P<level>\w{2})\.)?",
-            description,
-        )
+        regex = VERB_PATTERN.match(description)
         if not regex:
             raise ParseError(f"Parse Error:\n{description}")
         return regex.groupdict()
 
     def _extract_adjective_data(self, description):
-        # incomparable adjectives
-        if regex := re.match(
-            r"The declension of the adjective (?P<text>\S+) (?:\(.*\)) uses the incomparable form"
-            r" (?P=text). "
-            r"The adjective has no forms for the comparative and superlative. "
-            r"The adjective (?P=text) can be used both attributively in front of a noun"
-            r" as well as predicative in conjunction with a verb."
-            r"One can not only inflect and compare (?P=text), but all German"
-            r" adjectives\.",
-            description,
-        ):
+        if regex := INCOMPARABLE_ADJECTIVE_PATTERN.match(description):
             return regex.groupdict() | {"is_comparable": False}
-
-        # comparable adjectives
-        if regex := re.match(
-            r"The declension of the adjective (?P<text>\S+) (?:\(.*\)) uses these forms of the"
-            r" comparison (?P=text),(?P<comparative>\S+),(?P<superlative>.+)\. "
-            r"The endings for the comparison in the comparative and superlative are"
-            r" (?P<comparative_ending>\S+)/(?P<superlative_ending>\S+). "
-            r"The adjective (?P=text) can be used both attributively in front of a noun"
-            r" as well as predicative in conjunction with a verb."
-            r"One can not only inflect and compare (?P=text), but all German"
-            r" adjectives\.",
-            description,
-        ):
+        if regex := COMPARABLE_ADJECTIVE_PATTERN.match(description):
             return regex.groupdict() | {"is_comparable": True}
         raise ParseError(f"Parse Error:\n{description}")
 
@@ -247,6 +347,26 @@ class VerbformenParser(AbstractParser):
         ]
 
 
+def related_search_url(href: str) -> Optional[str]:
+    """
+    Map a dictionary link to the search url ``create_search_url`` would build.
+
+    Handles both ``/conjugation/?w=essen`` and ``/conjugation/essen.htm`` forms,
+    so a prefetched page lands under the cache key a later ``--verb``/``--noun``
+    search will use. ``RelatedPagePrefetcher`` routes unhinted searches to it.
+    """
+    parsed = urllib.parse.urlparse(href)
+    for path, part_of_speech in RELATED_PATHS.items():
+        if not parsed.path.startswith(path):
+            continue
+        word = urllib.parse.parse_qs(parsed.query).get("w", [None])[0]
+        if word is None and parsed.path.endswith(".htm"):
+            word = urllib.parse.unquote(parsed.path[len(path) : -len(".htm")])
+        if word and "/" not in word:
+            return create_search_url(word, part_of_speech)
+    return None
+
+
 def clean_whitespace(text: str):
     if not text:
         return text
@@ -0,0 +1,295 @@
+import collections
+import itertools
+import pathlib
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Set
+
+from pydantic import BaseModel
+
+from verbformen_cli.downloaders import (
+    CachedDownloader,
+    DownloaderError,
+    Priority,
+    download_priority,
+)
+from verbformen_cli.metrics import metrics
+from verbformen_cli.models import Definition, PartOfSpeech, SearchResult
+from verbformen_cli.parsers import AbstractParser, VerbformenParser
+from verbformen_cli.routing import PartOfSpeechRouter
+
+
+class PrefetchStats(BaseModel):
+    fetched: int = 0
+    skipped: int = 0
+    failed: int = 0
+    # replaced page versions deleted after the run
+    removed: int = 0
+
+
+class RateLimiter:
+    """Space calls at least ``1 / rate`` seconds apart across all threads."""
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """
+    Append-only file of urls that were already prefetched.
+
+    The first line records when the run started; a checkpoint older than
+    ``max_age`` seconds is ignored, since the pages it lists may have expired.
+    """
+
+    def __init__(self, path: Optional[pathlib.Path], max_age: Optional[float] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done: Set[str] = set()
+        if path and path.is_file():
+            lines = path.read_text(encoding="UTF-8").splitlines()
+            started = _checkpoint_started(lines[0]) if lines else None
+            if started is None or max_age is None or time.time() - started < max_age:
+                self.done = {line for line in lines if not line.startswith("#")}
+            else:
+                self.clear()
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.done
+
+    def clear(self):
+        """forget the finished run so the next one starts from scratch"""
+        self.done = set()
+        if self.path:
+            self.path.unlink(missing_ok=True)
+
+    def mark(self, url: str):
+        with self._lock:
+            self.done.add(url)
+            if self.path:
+                header = "" if self.path.exists() else f"# started {time.time()}\n"
+                with self.path.open("a", encoding="UTF-8") as f:
+                    f.write(header + url + "\n")
+
+
+def _checkpoint_started(line: str) -> Optional[float]:
+    match = re.fullmatch(r"# started ([\d.]+)", line)
+    return float(match.group(1)) if match else None
+
+
+class Prefetcher:
+    """
+    Crawl urls into a ``CachedDownloader`` ahead of user traffic.
+
+    Urls that are still fresh in the cache, or recorded in the checkpoint of an
+    interrupted run, are skipped without touching the network. The checkpoint is
+    removed once a run finishes; failed urls are retried by the next run.
+    """
+
+    def __init__(
+        self,
+        downloader: CachedDownloader,
+        concurrency: int = 4,
+        rate: Optional[float] = 2.0,
+        checkpoint: Optional[pathlib.Path] = None,
+    ):
+        """
+        :param downloader: cache to warm
+        :param concurrency: maximum number of downloads in flight
+        :param rate: maximum downloads started per second, None for no limit
+        :param checkpoint: file recording finished urls so a run can resume
+        """
+        self.downloader = downloader
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.checkpoint = Checkpoint(checkpoint, downloader.max_age)
+
+    def run(self, urls: Iterable[str]) -> PrefetchStats:
+        stats = PrefetchStats()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for outcome in executor.map(self._prefetch, urls):
+                setattr(stats, outcome, getattr(stats, outcome) + 1)
+        self.checkpoint.clear()
+        if stats.fetched:
+            stats.removed = self.downloader.collect_garbage()
+        return stats
+
+    def start(self, urls: Iterable[str]) -> threading.Thread:
+        """run in a background daemon thread"""
+        thread = threading.Thread(target=self.run, args=(urls,), daemon=True)
+        thread.start()
+        return thread
+
+    def _prefetch(self, url: str) -> str:
+        if url in self.checkpoint:
+            outcome = "skipped"
+        elif self.downloader.is_fresh(url):
+            self.checkpoint.mark(url)
+            outcome = "skipped"
+        else:
+            self.limiter.acquire()
+            try:
+                with download_priority(Priority.PREFETCH):
+                    self.downloader.download(url)
+            except DownloaderError:
+                outcome = "failed"
+            else:
+                self.checkpoint.mark(url)
+                outcome = "fetched"
+        metrics.increment("verbformen_prefetch_total", outcome=outcome)
+        return outcome
+
+
+class RelatedPagePrefetcher:
+    """
+    Low priority background queue for pages linked from parsed results.
+
+    Urls are deduplicated and served shallowest first by a single daemon worker.
+    Each fetched page is parsed once, and the related links ``parser`` reports
+    from it are queued one level deeper, up to ``max_depth``. When the queue is
+    full, new urls are dropped.
+    """
+
+    def __init__(
+        self,
+        downloader: CachedDownloader,
+        max_depth: int = 1,
+        maxsize: int = 256,
+        rate: Optional[float] = 1.0,
+        router: Optional[PartOfSpeechRouter] = None,
+        max_seen: int = 4096,
+        parser: Optional[AbstractParser] = None,
+    ):
+        """
+        :param router: learns the route to each prefetched entry, so unhinted
+            searches for it find the prefetched page
+        :param max_seen: number of recently submitted urls remembered to skip
+            duplicates
+        :param parser: parses prefetched pages, e.g. the client's caching parser;
+            its ``on_related`` should call ``submit``. Defaults to a plain
+            ``VerbformenParser`` wired that way
+        """
+        self.downloader = downloader
+        self.max_depth = max_depth
+        self.limiter = RateLimiter(rate)
+        self.parser = parser or VerbformenParser(on_related=self.submit)
+        self.router = router
+        self.max_seen = max_seen
+        self._queue: queue.PriorityQueue = queue.PriorityQueue(maxsize)
+        self._order = itertools.count()
+        self._seen: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # depth of the page the worker is parsing, for the links it reports
+        self._local = threading.local()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def submit(self, urls: Iterable[str], depth: Optional[int] = None):
+        """
+        Queue ``urls`` at ``depth``; by default one level below the prefetched
+        page being parsed, or at depth 1 for pages parsed elsewhere.
+        """
+        if depth is None:
+            depth = getattr(self._local, "depth", 0) + 1
+        if depth > self.max_depth:
+            return
+        for url in urls:
+            with self._lock:
+                if url in self._seen:
+                    self._seen.move_to_end(url)
+                    continue
+                self._seen[url] = None
+                if len(self._seen) > self.max_seen:
+                    self._seen.popitem(last=False)
+            try:
+                self._queue.put_nowait((depth, next(self._order), url))
+            except queue.Full:
+                with self._lock:
+                    self._seen.pop(url, None)
+                metrics.increment(
+                    "verbformen_related_prefetch_total", outcome="dropped"
+                )
+
+    def join(self):
+        """block until every queued url has been handled"""
+        self._queue.join()
+
+    def _work(self):
+        while True:
+            depth, _, url = self._queue.get()
+            try:
+                with download_priority(Priority.PREFETCH):
+                    self._prefetch(url, depth)
+            except Exception:
+                # a broken page must not take the background worker down
+                metrics.increment("verbformen_related_prefetch_total", outcome="error")
+            finally:
+                self._queue.task_done()
+
+    def _prefetch(self, url: str, depth: int):
+        fresh = self.downloader.is_fresh(url)
+        if not fresh:
+            self.limiter.acquire()
+        try:
+            html = self.downloader.download(url)
+        except DownloaderError:
+            metrics.increment("verbformen_related_prefetch_total", outcome="failed")
+            return
+        outcome = "skipped" if fresh else "fetched"
+        metrics.increment("verbformen_related_prefetch_total", outcome=outcome)
+        self._local.depth = depth
+        try:
+            result = self.parser.parse_page(html)
+        finally:
+            del self._local.depth
+        if self.router:
+            self._learn_route(url, result)
+
+    def _learn_route(self, url: str, result: SearchResult):
+        """
+        Route searches for the prefetched entry to ``url``, which is the
+        noun/verb endpoint of the link rather than the generic search url.
+        """
+        if not isinstance(result, Definition) or self.router is None:
+            return
+        resolved = PartOfSpeech(result.part_of_speech)
+        # an unhinted search that already resolves elsewhere keeps its route
+        hint = None if self.router.resolve(result.search) is None else resolved
+        self.router.learn(result.search, hint, resolved, url, result.text)
+
+
+def read_word_list(path: pathlib.Path) -> List[str]:
+    """
+    Words of a frequency-ranked list, most frequent first.
+
+    Each line holds a word, optionally with rank or count columns separated by
+    whitespace, tabs or commas; the first non-numeric column is the word.
+    Blank lines and lines starting with ``#`` are ignored.
+    """
+    words: List[str] = []
+    seen = set()
+    for line in path.read_text(encoding="UTF-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        columns = [c for c in re.split(r"[\s,;]+", line) if c]
+        word = next((c for c in columns if not re.fullmatch(r"[\d.]+", c)), None)
+        if word and word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
@@ -0,0 +1,87 @@
+import json
+from typing import Dict, Optional, Type
+
+from pydantic import BaseModel
+
+from verbformen_cli.cache_backends import AbstractCacheBackend
+from verbformen_cli.downloaders import CachedDownloader, content_hash
+from verbformen_cli.metrics import metrics
+from verbformen_cli.models import Adjective, NotFound, Noun, SearchResult, Verb
+from verbformen_cli.parsers import PARSE_ERRORS, AbstractParser
+
+RESULT_TYPES: Dict[str, Type[SearchResult]] = {
+    "Noun": Noun,
+    "Verb": Verb,
+    "Adjective": Adjective,
+    "NotFound": NotFound,
+}
+
+
+class ReparseStats(BaseModel):
+    parsed: int = 0
+    current: int = 0
+    failed: int = 0
+    removed: int = 0
+
+
+class CachingParser(AbstractParser):
+    """
+    Remember parse results by page content hash and parser version.
+
+    A page is parsed again only when its content or ``parser.version`` changed.
+    """
+
+    def __init__(self, parser: AbstractParser, cache: AbstractCacheBackend):
+        self.parser = parser
+        self.cache = cache
+        self.version = parser.version
+
+    def parse_page(self, html: str) -> SearchResult:
+        digest = content_hash(html)
+        result = self._load(digest)
+        metrics.increment(
+            "verbformen_result_cache_requests_total",
+            result="miss" if result is None else "hit",
+        )
+        if result is None:
+            result = self.parser.parse_page(html)
+            self._save(digest, result)
+        return result
+
+    def reparse(self, downloader: CachedDownloader) -> ReparseStats:
+        """
+        Parse every cached page whose stored result is missing or was produced
+        by another parser version, after deleting pages and results no url
+        points to any more.
+        """
+        stats = ReparseStats(removed=downloader.collect_garbage())
+        for digest, page in downloader.cached_pages():
+            if self._load(digest) is not None:
+                stats.current += 1
+                continue
+            try:
+                result = self.parser.parse_page(page)
+            except PARSE_ERRORS:
+                stats.failed += 1
+                continue
+            self._save(digest, result)
+            stats.parsed += 1
+        return stats
+
+    def _load(self, digest: str) -> Optional[SearchResult]:
+        entry = self.cache.get(f"results/{digest}")
+        if entry is None:
+            return None
+        stored = json.loads(entry.value)
+        if stored["parser_version"] != self.parser.version:
+            return None
+        return RESULT_TYPES[stored["type"]].parse_obj(stored["result"])
+
+    def _save(self, digest: str, result: SearchResult):
+        stored = {
+            "parser_version": self.parser.version,
+            "type": type(result).__name__,
+            # part_of_speech follows from the type
+            "result": json.loads(result.json(exclude={"part_of_speech"})),
+        }
+        self.cache.set(f"results/{digest}", json.dumps(stored, ensure_ascii=False))
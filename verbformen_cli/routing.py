@@ -0,0 +1,77 @@
+import threading
+import urllib.parse
+from typing import Dict, Optional
+
+from verbformen_cli.cache_backends import AbstractCacheBackend
+from verbformen_cli.models import PartOfSpeech
+from verbformen_cli.normalize import normalize_term
+
+
+class PartOfSpeechRouter:
+    """
+    Persistent map from search term and part of speech hint to the url that
+    answered it.
+
+    Searches for a word that was already resolved go straight to the cached page,
+    whichever endpoint (generic, noun or verb) originally served it.
+    """
+
+    def __init__(self, cache: Optional[AbstractCacheBackend] = None):
+        """
+        :param cache: backend the routes are stored in, under the "routes"
+            namespace; None to keep them in memory only
+        """
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._routes: Dict[str, str] = {}
+
+    def resolve(
+        self, word: str, part_of_speech: Optional[PartOfSpeech] = None
+    ) -> Optional[str]:
+        return self._get(route_key(word, part_of_speech))
+
+    def learn(
+        self,
+        word: str,
+        hint: Optional[PartOfSpeech],
+        resolved: PartOfSpeech,
+        url: str,
+        lemma: Optional[str] = None,
+    ):
+        """
+        Record that searching ``word`` with ``hint`` yielded a ``resolved`` result
+        from ``url``.
+
+        The search term maps to the url for the hint it was searched with and for
+        the resolved part of speech; the dictionary form ``lemma`` maps to it too.
+        Existing routes for the resolved part of speech are kept, so every way of
+        reaching a page converges on the url that was downloaded first.
+        """
+        with self._lock:
+            routes = {}
+            if hint is None or hint == resolved:
+                routes[route_key(word, hint)] = url
+            for term in filter(None, [word, lemma]):
+                key = route_key(term, resolved)
+                routes[key] = self._get(key) or url
+            for key, value in routes.items():
+                if self._get(key) != value:
+                    self._routes[key] = value
+                    if self.cache:
+                        self.cache.set(_cache_key(key), value)
+
+    def _get(self, key: str) -> Optional[str]:
+        if key not in self._routes and self.cache:
+            entry = self.cache.get(_cache_key(key))
+            if entry:
+                self._routes[key] = entry.value
+        return self._routes.get(key)
+
+
+def route_key(word: str, part_of_speech: Optional[PartOfSpeech] = None) -> str:
+    pos = part_of_speech.value if part_of_speech else ""
+    return f"{pos}:{normalize_term(word, part_of_speech)}"
+
+
+def _cache_key(key: str) -> str:
+    return f"routes/{urllib.parse.quote(key, safe='')}"
@@ -1,10 +1,39 @@
 import pathlib
+from typing import Optional
 
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     cache_dir: pathlib.Path = pathlib.Path(__file__).parents[1] / ".cache"
+    # "filesystem", "sqlite" or "http", see cache_backends.create_backend
+    cache_backend: str = "filesystem"
+    # sqlite database path or base url of the shared http cache
+    cache_url: Optional[str] = None
+    # shared secret between the http cache server and its clients
+    cache_token: Optional[str] = None
+    # seconds before a cached page is considered stale, None to never expire
+    cache_max_age: Optional[float] = None
+    # serve expired pages for this many seconds while refreshing them
+    cache_stale_while_revalidate: float = 0
+    # seconds to wait for verbformen to connect or send data before a download fails
+    download_timeout: Optional[float] = 10
+    # seconds a failed download is remembered before verbformen is asked again
+    negative_cache_ttl: Optional[float] = 60
+    # consecutive download failures after which requests stop
+    circuit_breaker_threshold: int = 5
+    # seconds before a trial request is let through again
+    circuit_breaker_reset: float = 30
+    # cache only the page regions the parser reads instead of whole pages
+    cache_fragments: bool = False
+    # prefetch pages linked from each result in the background, up to this depth
+    prefetch_related_depth: int = 0
+    # downloads in flight at once, shared by interactive, batch and prefetch traffic
+    download_connections: int = 4
+    # of which at most this many serve background prefetching
+    prefetch_connections: int = 2
+    # seconds a page may take to parse before it is rejected, None for no limit
+    parse_time_budget: Optional[float] = 2.0
 
 
 settings = Settings()